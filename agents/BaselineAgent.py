@@ -5,11 +5,13 @@ import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
 import torch.distributions as distributions
+from agents.PPOAgent import PPOAgent
+from language_model.model import bptt_starts
 from utils.Trainer import Transition
 
 device = "cpu"
 
-class BaselineAgent:
+class BaselineAgent(PPOAgent):
     def __init__(self, model, learning_rate=0.001, lmbda=0.95, gamma=0.99,
                  clip_param=0.2, value_param=1, entropy_act_param=0.01):
 
@@ -19,6 +21,22 @@ class BaselineAgent:
         self.model = model.to(device)
         self.optimizer = optim.Adam(self.model.parameters(), lr=learning_rate)
 
+        # Model used for acting, a transformed copy of self.model if actor_transform is set
+        self.actor_model = self.model
+        self.actor_transform = None
+
+        # Set by distributed training to average gradients over ranks
+        self.reduce_gradients = None
+
+        # Truncated BPTT window for replaying the history memory in update, 0 for whole episodes
+        self.mem_bptt = 0
+
+        # Off-policy reuse of past episodes, replay_ratio extra updates per episode when a buffer is set
+        self.replay_buffer = None
+        self.replay_ratio = 0
+        self.vtrace_clip = 1.0
+        self.replaying = False
+
         self.clip_param = clip_param
         self.entropy_act_param = entropy_act_param
         self.value_param = value_param
@@ -32,7 +50,7 @@ class BaselineAgent:
         # Calculate policy
         _ = hist_mem # don't do anything with this, just here to make Trainer function look nicer
         observation = torch.FloatTensor(observation).to(device)
-        logits = self.model.policy(observation)
+        logits = self.actor_model.policy(observation)
         action_prob = F.softmax(logits.squeeze() / self.T, dim=-1)
         dist = distributions.Categorical(action_prob)
         action = dist.sample()
@@ -45,7 +63,7 @@ class BaselineAgent:
 
         state, answer, hidden_q, action, reward, reward_qa, \
         log_prob_act, log_prob_qa, entropy_act, entropy_qa, \
-        done, _, hidden_hist_mem, cell_hist_mem = current_trans
+        done, _, hidden_hist_mem, cell_hist_mem, *_ = current_trans
 
         next_state, next_answer, next_hidden_q, *_ = next_trans
 
@@ -55,15 +73,14 @@ class BaselineAgent:
         # Get next V
         next_V_pred = self.model.value(next_state, hidden_hist_mem).squeeze()
 
-        # Compute TD error
-        target = reward.squeeze().to(device) + self.gamma * next_V_pred * done.squeeze().to(device)
-        td_error = (target - V_pred).detach()
+        # Probability of the taken actions under the current policy
+        pi_a = self.action_prob(action, state)
 
-        # Generalised Advantage Estimation
-        advantage = self.gae(td_error)
+        # TD targets and Generalised Advantage Estimation, V-trace for a replayed episode
+        target, advantage = self.advantages(reward, done, V_pred, next_V_pred, pi_a, log_prob_act)
 
         # Clipped PPO Policy Loss
-        L_clip = self.clip_loss(action, advantage, log_prob_act, state)
+        L_clip = self.clip_loss(pi_a, log_prob_act, advantage)
 
         # Entropy regularizer
         L_entropy = self.entropy_act_param * entropy_act.detach().mean()
@@ -75,46 +92,10 @@ class BaselineAgent:
         total_loss = -(L_clip - L_value + L_entropy).to(device)
 
         # Update params
-        self.optimizer.zero_grad()
-        total_loss.backward()
-        self.optimizer.step()
+        self.optimize(total_loss)
 
         return total_loss.item(), (L_clip, L_value, L_entropy, None, None)
 
-    def gae(self, td_error):
-        advantage_list = []
-        advantage = 0.0
-        for delta in reversed(td_error):
-            advantage = self.gamma * self.lmbda * advantage + delta
-            advantage_list.append([advantage])
-        advantage_list.reverse()
-        advantage = torch.FloatTensor(advantage_list).to(device)
-        return advantage
-
-    def clip_loss(self, action, advantage, log_prob_act, state):
-        logits = self.model.policy(state)
-        probs = F.softmax(logits, dim=-1)
-        pi_a = probs.squeeze(1).gather(1, action.long())
-        ratio = torch.exp(torch.log(pi_a) - torch.log(log_prob_act))
-        surrogate1 = ratio * advantage
-        surrogate2 = advantage * torch.clamp(ratio, 1.0 - self.clip_param, 1.0 + self.clip_param)
-        L_clip = torch.min(surrogate1, surrogate2).mean()
-        return L_clip
-
-    def get_batch(self):
-
-        current_trans = Transition(*zip(*self.data))
-        current_trans = self.transition_to_tensors(current_trans)
-
-        next_data = self.data[1:]
-        next_trans = Transition(*zip(*next_data))
-        next_trans = self.transition_to_tensors(next_trans)
-        next_trans = Transition(*list(map(expand_zeros, next_trans)))
-
-        self.data = []
-        return current_trans, next_trans
-
-
     def transition_to_tensors(self, trans):
         state = torch.FloatTensor(trans.state).to(device)
         answer = torch.FloatTensor(trans.answer).to(device)
@@ -124,25 +105,20 @@ class BaselineAgent:
         reward_qa = torch.FloatTensor(trans.reward_qa).to(device)
         # next_state = torch.FloatTensor(trans.next_state).to(device)
         log_prob_act = torch.FloatTensor(trans.log_prob_act).to(device).view(-1, 1)
-        log_prob_qa = torch.stack(list(map(lambda t: torch.stack(t).mean().to(device), trans.log_prob_qa)))
+        log_prob_qa = torch.FloatTensor(trans.log_prob_qa).to(device)
         entropy_act = torch.FloatTensor(trans.entropy_act).to(device).view(-1, 1)
         entropy_qa = torch.FloatTensor(trans.entropy_qa).to(device)
         done = ~torch.BoolTensor(trans.done).to(device).view(-1, 1)  # You need the tilde!
         hidden_hist_mem = torch.cat(trans.hidden_hist_mem)
         cell_hist_mem = torch.cat(trans.cell_hist_mem)
         q_embedding = torch.stack(trans.q_embedding)
+        question_tokens = torch.stack(trans.question_tokens)
+        cell_q = torch.cat(trans.cell_q)
 
         return Transition(state, answer, hidden_q, action, reward, reward_qa,
                 log_prob_act, log_prob_qa, entropy_act, entropy_qa,
-                done, q_embedding, hidden_hist_mem, cell_hist_mem)
-
-    def store(self, transition):
-        self.data.append(transition)
-
-    def init_memory(self):
-        return (torch.rand(1, self.model.mem_hidden_dim),
-                torch.rand(1, self.model.mem_hidden_dim))
-
+                done, q_embedding, hidden_hist_mem, cell_hist_mem,
+                question_tokens, cell_q)
 
 class BaselineAgentExpMem(BaselineAgent):
     def __init__(self, model, learning_rate=0.001, lmbda=0.95, gamma=0.99,
@@ -152,7 +128,7 @@ class BaselineAgentExpMem(BaselineAgent):
     def act(self, observation, hist_mem):
         # Calculate policy
         observation = torch.FloatTensor(observation).to(device)
-        logits = self.model.policy(observation, hist_mem)
+        logits = self.actor_model.policy(observation, hist_mem)
         action_prob = F.softmax(logits.squeeze() / self.T, dim=-1)
         dist = distributions.Categorical(action_prob)
         action = dist.sample()
@@ -165,7 +141,7 @@ class BaselineAgentExpMem(BaselineAgent):
 
         state, answer, hidden_q, action, reward, reward_qa, \
         log_prob_act, log_prob_qa, entropy_act, entropy_qa, \
-        done, _, hidden_hist_mem, cell_hist_mem = current_trans
+        done, _, hidden_hist_mem, cell_hist_mem, *_ = current_trans
 
         next_state, next_answer, next_hidden_q, *_ = next_trans
 
@@ -175,16 +151,14 @@ class BaselineAgentExpMem(BaselineAgent):
         # Get next V
         next_V_pred = self.model.value(next_state, hidden_hist_mem).squeeze()
 
-        # Compute TD error
-        target = reward.squeeze().to(device) + self.gamma * next_V_pred * done.squeeze().to(device)
-        td_error = (target - V_pred).detach()
+        # Probability of the taken actions under the current policy
+        pi_a = self.action_prob(action, state, hidden_hist_mem)
 
-        # Generalised Advantage Estimation
-        advantage = self.gae(td_error)
+        # TD targets and Generalised Advantage Estimation, V-trace for a replayed episode
+        target, advantage = self.advantages(reward, done, V_pred, next_V_pred, pi_a, log_prob_act)
 
         # Clipped PPO Policy Loss
-        # TODO - try to unify clip_loss wit and w/o hidden_hist_mem
-        L_clip = self.clip_loss(action, advantage, log_prob_act, state, hidden_hist_mem)
+        L_clip = self.clip_loss(pi_a, log_prob_act, advantage)
 
         # Entropy regularizer
         L_entropy = self.entropy_act_param * entropy_act.detach().mean()
@@ -196,30 +170,22 @@ class BaselineAgentExpMem(BaselineAgent):
         total_loss = -(L_clip - L_value + L_entropy).to(device)
 
         # Update params
-        self.optimizer.zero_grad()
-        total_loss.backward()
-        self.optimizer.step()
+        self.optimize(total_loss)
 
         return total_loss.item(), (L_clip, L_value, L_entropy, None, None)
 
-    def clip_loss(self, action, advantage, log_prob_act, state, hidden_hist):
-        # TODO - try to unify clip_loss wit and w/o hidden_hist_mem
-        logits = self.model.policy(state, hidden_hist)
-        probs = F.softmax(logits, dim=-1)
-        pi_a = probs.squeeze(1).gather(1, action.long())
-        ratio = torch.exp(torch.log(pi_a) - torch.log(log_prob_act))
-        surrogate1 = ratio * advantage
-        surrogate2 = advantage * torch.clamp(ratio, 1.0 - self.clip_param, 1.0 + self.clip_param)
-        L_clip = torch.min(surrogate1, surrogate2).mean()
-        return L_clip
-
     def remember(self, state, action, hist_mem):
         action_one_hot = torch.zeros((1, 7)).to(device)
         action_one_hot[0, action] = 1
         obs = torch.FloatTensor(state).to(device)
-        memory = self.model.remember(obs, action_one_hot, hist_mem)
+        memory = self.actor_model.remember(obs, action_one_hot, hist_mem)
         return memory
 
-def expand_zeros(tensor):
-    pad = torch.zeros_like(tensor[0]).unsqueeze(0)
-    return torch.cat((tensor, pad), 0)
+    def transition_to_tensors(self, trans):
+        starts = bptt_starts(trans.done, self.mem_bptt)
+        trans = super().transition_to_tensors(trans)
+        # The memory was computed without a graph, rebuild it through every segment from its stored state
+        action_one_hot = F.one_hot(trans.action.long().view(-1), 7).float()
+        hidden_hist_mem = self.model.replay_memory(trans.state, action_one_hot, trans.hidden_hist_mem,
+                                                   trans.cell_hist_mem, starts)
+        return trans._replace(hidden_hist_mem=hidden_hist_mem)
@@ -4,14 +4,17 @@ import torch
 import torch.optim as optim
 import torch.nn.functional as F
 import torch.distributions as distributions
+from torch.nn.utils.rnn import pad_sequence
 
+from agents.PPOAgent import PPOAgent
+from language_model.model import bptt_starts
 from utils.Trainer import Transition
 
 
 device = "cpu"
 
 
-class Agent:
+class Agent(PPOAgent):
     def __init__(self, model, learning_rate=0.001, lmbda=0.95, gamma=0.99,
                  clip_param=0.2, value_param=1, entropy_act_param=0.01,
                  policy_qa_param=1, advantage_qa_param=0.5, entropy_qa_param=0.05):
@@ -32,21 +35,37 @@ class Agent:
         self.optimizer = optim.Adam(self.model.parameters(), lr=learning_rate)
         self.optimizer_qa = optim.Adam(self.model.parameters(), lr=learning_rate)
 
+        # Model used for acting, a transformed copy of self.model if actor_transform is set
+        self.actor_model = self.model
+        self.actor_transform = None
+
+        # Set by distributed training to average gradients over ranks
+        self.reduce_gradients = None
+
+        # Truncated BPTT window for replaying the history memory in update, 0 for whole episodes
+        self.mem_bptt = 0
+
+        # Off-policy reuse of past episodes, replay_ratio extra updates per episode when a buffer is set
+        self.replay_buffer = None
+        self.replay_ratio = 0
+        self.vtrace_clip = 1.0
+        self.replaying = False
+
         self.done = True
         self.data = []
 
     def ask(self, observation, hidden_hist_mem):
         observation = torch.FloatTensor(observation).to(device)
-        tokens, hidden_q, log_probs_qa, entropy_qa = self.model.gen_question(observation, hidden_hist_mem)
+        tokens, hidden_q, log_probs_qa, entropy_qa, question = self.actor_model.gen_question(observation, hidden_hist_mem)
         output = ' '.join(tokens)
-        return output, hidden_q, log_probs_qa, entropy_qa
+        return output, hidden_q, log_probs_qa, entropy_qa, question
 
     def act(self, observation, ans, hidden_q, hidden_hist):
         # Calculate policy
         _ = hidden_hist # does nothing, just accepts
         observation = torch.FloatTensor(observation).to(device)
         ans = torch.FloatTensor(ans).view((-1, 2)).to(device)
-        logits = self.model.policy(observation, ans, hidden_q)
+        logits = self.actor_model.policy(observation, ans, hidden_q)
         # does nothing, just accepts
         action_prob = F.softmax(logits.squeeze() / self.T, dim=-1)
         dist = distributions.Categorical(action_prob)
@@ -61,7 +80,7 @@ class Agent:
 
         state, answer, hidden_q, action, reward, reward_qa, \
         log_prob_act, log_prob_qa, entropy_act, entropy_qa, \
-        done, _, hidden_hist_mem, cell_hist_mem = current_trans
+        done, _, hidden_hist_mem, cell_hist_mem, *_ = current_trans
 
         next_state, next_answer, next_hidden_q, *_ = next_trans
 
@@ -71,15 +90,14 @@ class Agent:
         # Get next V
         next_V_pred = self.model.value(next_state, next_answer, next_hidden_q).squeeze()
 
-        # Compute TD error
-        target = reward.squeeze().to(device) + self.gamma * next_V_pred * done.squeeze().to(device)
-        td_error = (target - V_pred).detach()
+        # Probability of the taken actions under the current policy
+        pi_a = self.action_prob(action, state, answer, hidden_q)
 
-        # Generalised Advantage Estimation
-        advantage = self.gae(td_error)
+        # TD targets and Generalised Advantage Estimation, V-trace for a replayed episode
+        target, advantage = self.advantages(reward, done, V_pred, next_V_pred, pi_a, log_prob_act)
 
         # Clipped PPO Policy Loss
-        L_clip = self.clip_loss(action, advantage, answer, log_prob_act, state, hidden_q)
+        L_clip = self.clip_loss(pi_a, log_prob_act, advantage)
 
         # Entropy regularizer
         L_entropy = self.entropy_act_param * entropy_act.detach().mean()
@@ -105,73 +123,80 @@ class Agent:
         total_loss = -(L_clip + L_qa - L_value + L_entropy).to(device)
 
         # Update paramss
-        self.optimizer.zero_grad()
-        total_loss.backward()
-        self.optimizer.step()
+        self.optimize(total_loss)
 
         return total_loss.item(), (L_clip, L_value, L_entropy, L_policy_qa, L_entropy_qa)
 
-    def gae(self, td_error):
-        advantage_list = []
-        advantage = 0.0
-        for delta in reversed(td_error):
-            advantage = self.gamma * self.lmbda * advantage + delta
-            advantage_list.append([advantage])
-        advantage_list.reverse()
-        advantage = torch.FloatTensor(advantage_list).to(device)
-        return advantage
-
-    def clip_loss(self, action, advantage, answer, log_prob_act, state, hidden_q):
-        logits = self.model.policy(state, answer, hidden_q)
-        probs = F.softmax(logits, dim=-1)
-        pi_a = probs.squeeze(1).gather(1, action.long())
-        ratio = torch.exp(torch.log(pi_a) - torch.log(log_prob_act))
-        surrogate1 = ratio * advantage
-        surrogate2 = advantage * torch.clamp(ratio, 1.0 - self.clip_param, 1.0 + self.clip_param)
-        L_clip = torch.min(surrogate1, surrogate2).mean()
-        return L_clip
-
-    def init_memory(self):
-        return (torch.rand(1, self.model.mem_hidden_dim),
-                torch.rand(1, self.model.mem_hidden_dim))
-
-    def store(self, transition):
-        self.data.append(transition)
-
-    def get_batch(self):
-
-        current_trans = Transition(*zip(*self.data))
-        current_trans = self.transition_to_tensors(current_trans)
-
-        next_data = self.data[1:]
-        next_trans = Transition(*zip(*next_data))
-        next_trans = self.transition_to_tensors(next_trans)
-        next_trans = Transition(*list(map(expand_zeros, next_trans)))
-
-        self.data = []
-        return current_trans, next_trans
-
-
     def transition_to_tensors(self, trans):
         state = torch.FloatTensor(trans.state).to(device)
         answer = torch.FloatTensor(trans.answer).to(device)
-        hidden_q = torch.cat(trans.hidden_q)
         action = torch.FloatTensor(trans.action).to(device).view(-1, 1)
         reward = torch.FloatTensor(trans.reward).to(device).view(-1, 1)
         reward_qa = torch.FloatTensor(trans.reward_qa).to(device)
         # next_state = torch.FloatTensor(trans.next_state).to(device)
         log_prob_act = torch.FloatTensor(trans.log_prob_act).to(device).view(-1, 1)
-        log_prob_qa = torch.stack(list(map(lambda t: torch.stack(t).mean().to(device), trans.log_prob_qa)))
         entropy_act = torch.FloatTensor(trans.entropy_act).to(device).view(-1, 1)
         entropy_qa = torch.FloatTensor(trans.entropy_qa).to(device)
         done = ~torch.BoolTensor(trans.done).to(device).view(-1, 1)  # You need the tilde!
         hidden_hist_mem = torch.cat(trans.hidden_hist_mem)
         cell_hist_mem = torch.cat(trans.cell_hist_mem)
         q_embedding = torch.stack(trans.q_embedding)
+        question_tokens = pad_sequence(trans.question_tokens, batch_first=True).to(device)
+        question_lengths = torch.LongTensor([len(t) for t in trans.question_tokens]).to(device)
+        cell_q = torch.cat(trans.cell_q)
+
+        # Questions and memory were sampled without a graph, rebuild it
+        if hasattr(self.model, "memory_rnn"):
+            action_one_hot = F.one_hot(action.long().view(-1), 7).float()
+            log_prob_qa, hidden_q, hidden_hist_mem = self.replay_history(
+                state, action_one_hot, answer, hidden_hist_mem, cell_hist_mem, cell_q, question_tokens,
+                question_lengths, bptt_starts(trans.done, self.mem_bptt))
+        else:
+            log_prob_qa, hidden_q = self.model.replay_question(state, hidden_hist_mem, cell_q,
+                                                               question_tokens, question_lengths)
+
+        # A replayed question was sampled by an older policy, weight its log prob by the clipped
+        # importance ratio of the whole question, the stored log prob is the mean over its tokens
+        if self.replaying:
+            behaviour_log_prob_qa = torch.FloatTensor(trans.log_prob_qa).to(device)
+            weight = torch.exp(question_lengths * (log_prob_qa - behaviour_log_prob_qa)).clamp(max=self.vtrace_clip)
+            log_prob_qa = log_prob_qa * weight.detach()
 
         return Transition(state, answer, hidden_q, action, reward, reward_qa,
                 log_prob_act, log_prob_qa, entropy_act, entropy_qa,
-                done, q_embedding, hidden_hist_mem, cell_hist_mem)
+                done, q_embedding, hidden_hist_mem, cell_hist_mem,
+                question_tokens, cell_q)
+
+    def replay_history(self, state, action, answer, hidden_hist_mem, cell_hist_mem, cell_q,
+                       question_tokens, question_lengths, starts):
+        """
+        the questions and history memory of a rollout with the graph acting would have built,
+        the memory before a step asks its question and the question's hidden state goes into the next memory,
+        so every BPTT segment runs step by step from its stored state, all segments side by side as one batch
+        returns the question log probs and hidden states and the memory before every step
+        """
+        bounds = list(starts) + [len(state)]
+        segments = sorted(zip(bounds[:-1], bounds[1:]), key=lambda segment: segment[0] - segment[1])
+        first = torch.tensor([start for start, _ in segments])
+        lengths = torch.tensor([end - start for start, end in segments])
+        h, c = hidden_hist_mem[first], cell_hist_mem[first]
+
+        # Longest segments first, the ones still running are always the first n
+        steps, log_probs_qa, hiddens_q, memories = [], [], [], []
+        for k in range(int(lengths[0])):
+            n = int((lengths > k).sum())
+            t = first[:n] + k
+            h, c = h[:n], c[:n]
+            log_prob_qa, hidden_q = self.model.replay_question(state[t], h, cell_q[t], question_tokens[t],
+                                                               question_lengths[t])
+            steps.append(t)
+            log_probs_qa.append(log_prob_qa)
+            hiddens_q.append(hidden_q)
+            memories.append(h)
+            h, c = self.model.remember(state[t], action[t], answer[t], hidden_q, (h, c))
+
+        order = torch.cat(steps).argsort()
+        return torch.cat(log_probs_qa)[order], torch.cat(hiddens_q)[order], torch.cat(memories)[order]
 
 class AgentMem(Agent):
     def __init__(self, model, learning_rate=0.001, lmbda=0.95, gamma=0.99,
@@ -186,7 +211,7 @@ class AgentMem(Agent):
         action_one_hot[0, action] = 1
         obs = torch.FloatTensor(state).to(device)
         answer = torch.FloatTensor(answer).view((-1, 2)).to(device)
-        memory = self.model.remember(obs, action_one_hot, answer, hidden_q, hist_mem)
+        memory = self.actor_model.remember(obs, action_one_hot, answer, hidden_q, hist_mem)
         return memory
 
     def act(self, observation, ans, hidden_q, hidden_hist_mem):
@@ -198,7 +223,7 @@ class AgentMem(Agent):
 
         observation = torch.FloatTensor(observation).to(device)
         ans = torch.FloatTensor(ans).view((-1, 2)).to(device)
-        logits = self.model.policy(observation, ans, hidden_q, hidden_hist_mem)
+        logits = self.actor_model.policy(observation, ans, hidden_q, hidden_hist_mem)
         action_prob = F.softmax(logits.squeeze() / self.T, dim=-1)
         dist = distributions.Categorical(action_prob)
         action = dist.sample()
@@ -206,21 +231,14 @@ class AgentMem(Agent):
         entropy = dist.entropy()  # Entropy regularizer
         return action.detach().item(), probs, entropy
 
-    def clip_loss(self, action, advantage, answer, log_prob_act, state, hidden_q):
+    def action_prob(self, action, state, answer, hidden_q):
         # hidden_hist_mem will be a placeholder here, passed to the policy,
         # but then subsequently ignored by the policy, if we have initialised it to YES use
         # memory, but not explicitly into the policy...
 
         hidden_hist_mem = torch.zeros(128)
+        return super().action_prob(action, state, answer, hidden_q, hidden_hist_mem)
 
-        logits = self.model.policy(state, answer, hidden_q, hidden_hist_mem)
-        probs = F.softmax(logits, dim=-1)
-        pi_a = probs.squeeze(1).gather(1, action.long())
-        ratio = torch.exp(torch.log(pi_a) - torch.log(log_prob_act))
-        surrogate1 = ratio * advantage
-        surrogate2 = advantage * torch.clamp(ratio, 1.0 - self.clip_param, 1.0 + self.clip_param)
-        L_clip = torch.min(surrogate1, surrogate2).mean()
-        return L_clip
 
 class AgentExpMem(Agent):
     def __init__(self, model, learning_rate=0.001, lmbda=0.95, gamma=0.99,
@@ -236,7 +254,7 @@ class AgentExpMem(Agent):
         # Calculate policy
         observation = torch.FloatTensor(observation).to(device)
         ans = torch.FloatTensor(ans).view((-1, 2)).to(device)
-        logits = self.model.policy(observation, ans, hidden_q, hidden_hist_mem)
+        logits = self.actor_model.policy(observation, ans, hidden_q, hidden_hist_mem)
         action_prob = F.softmax(logits.squeeze() / self.T, dim=-1)
         dist = distributions.Categorical(action_prob)
         action = dist.sample()
@@ -248,10 +266,10 @@ class AgentExpMem(Agent):
         current_trans, next_trans = self.get_batch()
 
         state, answer, hidden_q, action, reward, reward_qa, \
-        log_prob_act, log_prob_qa, entropy_act, entropy_qa, done, _, hidden_hist_mem, cell_hist_mem  = current_trans
+        log_prob_act, log_prob_qa, entropy_act, entropy_qa, done, _, hidden_hist_mem, cell_hist_mem, *_ = current_trans
 
         next_state, next_answer, next_hidden_q, *_ = next_trans
-        *_ , next_hidden_hist_mem, cell_hist_mem = next_trans
+        next_hidden_hist_mem = next_trans.hidden_hist_mem
 
         # Get next V
         # Get current V
@@ -260,16 +278,14 @@ class AgentExpMem(Agent):
         # Get next V
         next_V_pred = self.model.value(next_state, next_answer, next_hidden_q, next_hidden_hist_mem).squeeze()
 
-        # Compute TD error
-        target = reward.squeeze().to(device) + self.gamma * next_V_pred * done.squeeze().to(device)
-        td_error = (target - V_pred).detach()
+        # Probability of the taken actions under the current policy
+        pi_a = self.action_prob(action, state, answer, hidden_q, hidden_hist_mem)
 
-        # Generalised Advantage Estimation
-        advantage = self.gae(td_error)
+        # TD targets and Generalised Advantage Estimation, V-trace for a replayed episode
+        target, advantage = self.advantages(reward, done, V_pred, next_V_pred, pi_a, log_prob_act)
 
         # Clipped PPO Policy Loss
-        # TODO - try to unify clip_loss wit and w/o hidden_hist_mem
-        L_clip = self.clip_loss(action, advantage, answer, log_prob_act, state, hidden_q,hidden_hist_mem)
+        L_clip = self.clip_loss(pi_a, log_prob_act, advantage)
 
         # Entropy regularizer
         L_entropy = self.entropy_act_param * entropy_act.detach().mean()
@@ -279,6 +295,7 @@ class AgentExpMem(Agent):
 
         # Q&A Loss
 
+        discounted_reward = torch.Tensor([(self.gamma**i) * reward.squeeze()[-1] for i in range(reward.shape[0])])
 
         R_t = torch.cumsum(discounted_reward,0).T
 
@@ -293,29 +310,16 @@ class AgentExpMem(Agent):
         total_loss = -(L_clip + L_qa - L_value + L_entropy).to(device)
 
         # Update paramss
-        self.optimizer.zero_grad()
-        total_loss.backward()
-        self.optimizer.step()
+        self.optimize(total_loss)
 
         return total_loss.item(), (L_clip, L_value, L_entropy, L_policy_qa, L_entropy_qa)
 
-    def clip_loss(self, action, advantage, answer, log_prob_act, state, hidden_q, hidden_hist):
-        logits = self.model.policy(state, answer, hidden_q,hidden_hist)
-        # TODO - try to unify clip_loss wit and w/o hidden_hist_mem
-        probs = F.softmax(logits, dim=-1)
-        pi_a = probs.squeeze(1).gather(1, action.long())
-        ratio = torch.exp(torch.log(pi_a) - torch.log(log_prob_act))
-        surrogate1 = ratio * advantage
-        surrogate2 = advantage * torch.clamp(ratio, 1.0 - self.clip_param, 1.0 + self.clip_param)
-        L_clip = torch.min(surrogate1, surrogate2).mean()
-        return L_clip
-
     def remember(self, state, action, answer, hidden_q, hist_mem):
         action_one_hot = torch.zeros((1, 7)).to(device)
         action_one_hot[0, action] = 1
         obs = torch.FloatTensor(state).to(device)
         answer = torch.FloatTensor(answer).view((-1, 2)).to(device)
-        memory = self.model.remember(obs, action_one_hot, answer, hidden_q, hist_mem)
+        memory = self.actor_model.remember(obs, action_one_hot, answer, hidden_q, hist_mem)
         return memory
 
 
@@ -336,7 +340,7 @@ class AgentExpMemEmbed(Agent):
         observation = torch.FloatTensor(observation).to(device)
         ans = torch.FloatTensor(ans).view((-1, 2)).to(device)
         q_embedding = q_embedding.unsqueeze(0)
-        logits = self.model.policy(observation, ans, hidden_q, hidden_hist_mem, q_embedding)
+        logits = self.actor_model.policy(observation, ans, hidden_q, hidden_hist_mem, q_embedding)
         action_prob = F.softmax(logits.squeeze() / self.T, dim=-1)
         dist = distributions.Categorical(action_prob)
         action = dist.sample()
@@ -348,10 +352,10 @@ class AgentExpMemEmbed(Agent):
         current_trans, next_trans = self.get_batch()
 
         state, answer, hidden_q, action, reward, reward_qa, \
-        log_prob_act, log_prob_qa, entropy_act, entropy_qa, done, q_embedding, hidden_hist_mem, cell_hist_mem = current_trans
+        log_prob_act, log_prob_qa, entropy_act, entropy_qa, done, q_embedding, hidden_hist_mem, cell_hist_mem, *_ = current_trans
 
         next_state, next_answer, next_hidden_q, *_ = next_trans
-        *_ , next_q_embedding, next_hidden_hist_mem, cell_hist_mem,  = next_trans
+        next_q_embedding, next_hidden_hist_mem = next_trans.q_embedding, next_trans.hidden_hist_mem
 
         # Get next V
         # Get current V
@@ -360,16 +364,14 @@ class AgentExpMemEmbed(Agent):
         # Get next V
         next_V_pred = self.model.value(next_state, next_answer, next_hidden_q, next_hidden_hist_mem, next_q_embedding).squeeze()
 
-        # Compute TD error
-        target = reward.squeeze().to(device) + self.gamma * next_V_pred * done.squeeze().to(device)
-        td_error = (target - V_pred).detach()
+        # Probability of the taken actions under the current policy
+        pi_a = self.action_prob(action, state, answer, hidden_q, hidden_hist_mem, q_embedding)
 
-        # Generalised Advantage Estimation
-        advantage = self.gae(td_error)
+        # TD targets and Generalised Advantage Estimation, V-trace for a replayed episode
+        target, advantage = self.advantages(reward, done, V_pred, next_V_pred, pi_a, log_prob_act)
 
         # Clipped PPO Policy Loss
-        # TODO - try to unify clip_loss wit and w/o hidden_hist_mem
-        L_clip = self.clip_loss(action, advantage, answer, log_prob_act, state, hidden_q,hidden_hist_mem, q_embedding)
+        L_clip = self.clip_loss(pi_a, log_prob_act, advantage)
 
         # Entropy regularizer
         L_entropy = self.entropy_act_param * entropy_act.detach().mean()
@@ -395,38 +397,28 @@ class AgentExpMemEmbed(Agent):
         total_loss = -(L_clip + L_qa - L_value + L_entropy).to(device)
 
         # Update paramss
-        self.optimizer.zero_grad()
-        total_loss.backward()
-        self.optimizer.step()
+        self.optimize(total_loss)
 
         return total_loss.item(), (L_clip, L_value, L_entropy, L_policy_qa, L_entropy_qa)
 
-    def clip_loss(self, action, advantage, answer, log_prob_act, state, hidden_q, hidden_hist, q_embedding):
-        logits = self.model.policy(state, answer, hidden_q,hidden_hist, q_embedding)
-        # TODO - try to unify clip_loss wit and w/o hidden_hist_mem
-        probs = F.softmax(logits, dim=-1)
-        pi_a = probs.squeeze(1).gather(1, action.long())
-        ratio = torch.exp(torch.log(pi_a) - torch.log(log_prob_act))
-        surrogate1 = ratio * advantage
-        surrogate2 = advantage * torch.clamp(ratio, 1.0 - self.clip_param, 1.0 + self.clip_param)
-        L_clip = torch.min(surrogate1, surrogate2).mean()
-        return L_clip
-
     def remember(self, state, action, answer, hidden_q, hist_mem):
         action_one_hot = torch.zeros((1, 7)).to(device)
         action_one_hot[0, action] = 1
         obs = torch.FloatTensor(state).to(device)
         answer = torch.FloatTensor(answer).view((-1, 2)).to(device)
-        memory = self.model.remember(obs, action_one_hot, answer, hidden_q, hist_mem)
+        memory = self.actor_model.remember(obs, action_one_hot, answer, hidden_q, hist_mem)
         return memory
 
+    def transition_to_tensors(self, trans):
+        question_lengths = torch.LongTensor([len(t) for t in trans.question_tokens]).to(device)
+        trans = super().transition_to_tensors(trans)
+        # Question embeddings are replayed with the questions
+        q_embedding = self.model.embed_questions(trans.question_tokens, question_lengths)
+        return trans._replace(q_embedding=q_embedding)
+
     def ask(self, observation, hidden_hist_mem):
         observation = torch.FloatTensor(observation).to(device)
-        tokens, hidden_q, log_probs_qa, entropy_qa, q_embedding = self.model.gen_question(observation, hidden_hist_mem)
+        tokens, hidden_q, log_probs_qa, entropy_qa, q_embedding, question = \
+            self.actor_model.gen_question(observation, hidden_hist_mem)
         output = ' '.join(tokens)
-        return output, hidden_q, log_probs_qa, entropy_qa, q_embedding
-
-
-def expand_zeros(tensor):
-    pad = torch.zeros_like(tensor[0]).unsqueeze(0)
-    return torch.cat((tensor, pad), 0)
+        return output, hidden_q, log_probs_qa, entropy_qa, q_embedding, question
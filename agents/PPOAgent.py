@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import torch
+import torch.nn.functional as F
+from utils.Trainer import Transition
+from utils.replay import vtrace
+
+device = "cpu"
+
+class PPOAgent:
+    """
+    the PPO update steps the main and baseline agents share,
+    subclasses set up the model, optimizer and replay attributes and define act, update and transition_to_tensors
+    """
+    def gae(self, td_error):
+        advantage_list = []
+        advantage = 0.0
+        for delta in reversed(td_error):
+            advantage = self.gamma * self.lmbda * advantage + delta
+            advantage_list.append([advantage])
+        advantage_list.reverse()
+        advantage = torch.FloatTensor(advantage_list).to(device)
+        return advantage
+
+    def action_prob(self, action, *policy_inputs):
+        logits = self.model.policy(*policy_inputs)
+        probs = F.softmax(logits, dim=-1)
+        return probs.squeeze(1).gather(1, action.long())
+
+    def advantages(self, reward, done, V_pred, next_V_pred, pi_a, log_prob_act):
+        # Replayed episodes come from an older policy, correct their targets with V-trace
+        reward, done = reward.squeeze().to(device), done.squeeze().to(device)
+        if self.replaying:
+            rho = (pi_a / log_prob_act).detach().squeeze(1)
+            return vtrace(reward, done, V_pred, next_V_pred, rho, self.gamma, self.lmbda,
+                          self.vtrace_clip, self.vtrace_clip)
+
+        target = reward + self.gamma * next_V_pred * done
+        advantage = self.gae((target - V_pred).detach())
+        return target, advantage
+
+    def clip_loss(self, pi_a, log_prob_act, advantage):
+        ratio = torch.exp(torch.log(pi_a) - torch.log(log_prob_act))
+        surrogate1 = ratio * advantage
+        surrogate2 = advantage * torch.clamp(ratio, 1.0 - self.clip_param, 1.0 + self.clip_param)
+        L_clip = torch.min(surrogate1, surrogate2).mean()
+        return L_clip
+
+    def replay(self):
+        """
+        replay_ratio more updates on episodes from the replay buffer, after the update on a new one
+        """
+        if self.replay_buffer is None:
+            return
+        self.replaying = True
+        try:
+            for episode in self.replay_buffer.sample(self.replay_ratio):
+                self.data = episode
+                self.update()
+        finally:
+            self.replaying = False
+
+    def store(self, transition):
+        self.data.append(transition)
+
+    def sync_actor(self):
+        if self.actor_transform is not None:
+            self.actor_model = self.actor_transform(self.model)
+
+    def optimize(self, loss):
+        self.optimizer.zero_grad()
+        loss.backward()
+        if self.reduce_gradients is None or self.reduce_gradients(self.model, contributes=True):
+            self.optimizer.step()
+
+    def skip_update(self):
+        # Distributed training, a rank with nothing to learn from still joins the gradient average,
+        # once for the update and once per replayed update of the other ranks
+        if self.reduce_gradients is not None:
+            for _ in range(1 + (self.replay_ratio if self.replay_buffer is not None else 0)):
+                self.optimizer.zero_grad()
+                if self.reduce_gradients(self.model, contributes=False):
+                    self.optimizer.step()
+
+    def get_batch(self):
+
+        current_trans = Transition(*zip(*self.data))
+        current_trans = self.transition_to_tensors(current_trans)
+
+        # Next transitions are the current ones shifted by one step
+        next_trans = Transition(*[expand_zeros(t[1:]) for t in current_trans])
+
+        if self.replay_buffer is not None and not self.replaying:
+            self.replay_buffer.add(self.data)
+        self.data = []
+        return current_trans, next_trans
+
+    def init_memory(self):
+        return (torch.rand(1, self.model.mem_hidden_dim),
+                torch.rand(1, self.model.mem_hidden_dim))
+
+
+def expand_zeros(tensor):
+    pad = torch.zeros_like(tensor[0]).unsqueeze(0)
+    return torch.cat((tensor, pad), 0)
@@ -0,0 +1,64 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# Bump when the tokenization in Dataset changes
+CACHE_VERSION = 1
+
+
+def cache_paths(path):
+    root, _ = os.path.splitext(path)
+    return root + ".vocab.json", root + ".tokens.npy"
+
+
+def content_hash(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def load_cache(path):
+    """
+    vocabulary and memory-mapped token stream cached for a phrases file
+    returns None if the cache is missing, from another version or built from different phrases
+    """
+    vocab_path, tokens_path = cache_paths(path)
+    try:
+        with open(vocab_path) as file:
+            vocab = json.load(file)
+        if vocab["version"] != CACHE_VERSION or vocab["sha256"] != content_hash(path):
+            return None
+        # Copy-on-write mapping, pages are only read in when used
+        tokens = np.load(tokens_path, mmap_mode='c')
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if tokens.shape != (vocab["n_tokens"],) or tokens.dtype != np.int64:
+        return None
+    return vocab["uniq_words"], tokens
+
+
+def save_cache(path, uniq_words, words_indexes):
+    """
+    write the cache next to the phrases file, each file atomically
+    the vocabulary is written last, so a reader never validates a partial token stream
+    """
+    vocab_path, tokens_path = cache_paths(path)
+    vocab = {
+        "version": CACHE_VERSION,
+        "sha256": content_hash(path),
+        "n_tokens": len(words_indexes),
+        "uniq_words": list(uniq_words),
+    }
+    suffix = f".{os.getpid()}.tmp"
+    try:
+        with open(tokens_path + suffix, 'wb') as file:
+            np.save(file, np.asarray(words_indexes, dtype=np.int64))
+        os.replace(tokens_path + suffix, tokens_path)
+
+        with open(vocab_path + suffix, 'w') as file:
+            json.dump(vocab, file)
+        os.replace(vocab_path + suffix, vocab_path)
+    except OSError:
+        # Read-only checkout, the dataset is simply rebuilt next time
+        pass
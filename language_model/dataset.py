@@ -2,6 +2,8 @@ import torch
 from collections import Counter
 import json
 
+from .cache import load_cache, save_cache
+
 
 class Dataset(torch.utils.data.Dataset):
     def __init__(
@@ -11,13 +13,22 @@ class Dataset(torch.utils.data.Dataset):
     ):
         self.cfg = cfg
         self.path = path
-        self.words = self.load_words()
-        self.uniq_words = self.get_uniq_words()
+
+        cached = load_cache(path)
+        if cached is None:
+            self.words = self.load_words()
+            self.uniq_words = self.get_uniq_words()
+            words_indexes = self.index_words()
+            save_cache(path, self.uniq_words, words_indexes)
+        else:
+            self.uniq_words, words_indexes = cached
 
         self.index_to_word = {index: word for index, word in enumerate(self.uniq_words)}
         self.word_to_index = {word: index for index, word in enumerate(self.uniq_words)}
 
-        self.words_indexes = [self.word_to_index[w] for w in self.words]
+        # Token stream stored once, every (input, target) window is a view into it
+        self.words_indexes = torch.as_tensor(words_indexes, dtype=torch.long)
+        self.windows = self.words_indexes.unfold(0, self.cfg.sequence_len + 1, 1)
 
     def load_words(self):
         premises = list(json.load(open(self.path)))
@@ -29,11 +40,14 @@ class Dataset(torch.utils.data.Dataset):
         word_counts = Counter(self.words)
         return sorted(word_counts, key=word_counts.get, reverse=True)
 
+    def index_words(self):
+        word_to_index = {word: index for index, word in enumerate(self.uniq_words)}
+        return [word_to_index[w] for w in self.words]
+
     def __len__(self):
-        return len(self.words_indexes) - self.cfg.sequence_len
+        return len(self.windows)
 
     def __getitem__(self, index):
-        return (
-            torch.tensor(self.words_indexes[index:index + self.cfg.sequence_len]),
-            torch.tensor(self.words_indexes[index + 1:index + self.cfg.sequence_len + 1]),
-        )
+        # index can be a list of indices, a whole (batch, sequence_len) block is one gather
+        window = self.windows[index]
+        return window[..., :-1], window[..., 1:]
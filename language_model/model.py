@@ -1,7 +1,6 @@
-from collections import Callable
-
 import torch
 from torch import nn
+from torch.nn.utils.rnn import pad_sequence
 from einops import rearrange
 import numpy as np
 from dataclasses import dataclass
@@ -17,6 +16,91 @@ class Config:
 
 cfg = Config()
 
+
+def lstm_sequence(cell, inputs, memory):
+    """
+    run an LSTMCell over a whole (batch, seq, input) block with the fused nn.LSTM kernel
+    the cell's own weights are used, so step-wise calls to the cell are unchanged
+    """
+    h, c = memory
+    weights = (cell.weight_ih, cell.weight_hh, cell.bias_ih, cell.bias_hh)
+    outputs, h, c = torch.lstm(inputs, (h.unsqueeze(0), c.unsqueeze(0)), weights,
+                               True, 1, 0.0, cell.training, False, True)
+    return outputs, (h.squeeze(0), c.squeeze(0))
+
+def lstm_segments(cell, inputs, h, c, starts):
+    """
+    truncated BPTT over one (seq, input) sequence, its segments run as one batch through lstm_sequence
+    h, c: (seq, hidden) stored states before every step, starts: first step of each segment
+    every segment starts from its stored state, returns the hidden state before every step
+    """
+    seq_len = inputs.shape[0]
+    bounds = list(starts) + [seq_len]
+    segments = [inputs[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    outputs, _ = lstm_sequence(cell, pad_sequence(segments, batch_first=True), (h[starts], c[starts]))
+
+    # States after every step, shifted to before it, stored states at the segment starts
+    after = torch.cat([outputs[i, :len(segment)] for i, segment in enumerate(segments)])
+    is_start = torch.zeros(seq_len, dtype=torch.bool)
+    is_start[starts] = True
+    return torch.where(is_start.unsqueeze(1), h, after.roll(1, 0))
+
+def bptt_starts(dones, window=0):
+    """
+    first step of every BPTT segment of a rollout, one at every episode start and, with window, every window steps
+    """
+    return [t for t in range(len(dones)) if t == 0 or dones[t - 1] or (window and t % window == 0)]
+
+def sample_questions(step, memory, sos, eos, max_len=6):
+    """
+    sample a batch of questions token by token in lockstep, gen_question's loop for many rows
+    step(x, memory) returns (batch, vocab) logits and the new memory for (batch,) token ids x
+    returns the tokens, the number of tokens of each row (up to and including <eos>),
+    their log probs and entropies, and each row's hidden state after its last token
+    """
+    batch_size = memory[0].shape[0]
+    x = torch.full((batch_size,), sos, dtype=torch.long)
+
+    tokens, log_probs, entropies = [], [], []
+    lengths = torch.zeros(batch_size, dtype=torch.long)
+    finished = torch.zeros(batch_size, dtype=torch.bool)
+    last_hidden_state = memory[0]
+
+    for _ in range(max_len):
+        logits, memory = step(x, memory)
+        dist = torch.distributions.Categorical(logits=logits)
+        tkn_idx = dist.sample()
+
+        active = ~finished
+        tokens.append(tkn_idx)
+        log_probs.append(dist.log_prob(tkn_idx))
+        entropies.append(dist.entropy())
+        lengths += active
+        mask = active.view(-1, *[1] * (memory[0].dim() - 1))
+        last_hidden_state = torch.where(mask, memory[0], last_hidden_state)
+
+        finished |= tkn_idx == eos
+        if finished.all():
+            break
+        x = tkn_idx
+
+    return torch.stack(tokens, 1), lengths, torch.stack(log_probs, 1), torch.stack(entropies, 1), last_hidden_state
+
+def decode_questions(dataset, tokens, lengths, log_probs, entropies):
+    """
+    per row of sample_questions: the question string, mean log prob, entropy and sampled ids
+    as gen_question returns them
+    """
+    questions, log_prob_qa, entropy_qa, question_tokens = [], [], [], []
+    for k in range(tokens.shape[0]):
+        n = lengths[k].item()
+        words = [dataset.index_to_word[idx] for idx in tokens[k, :n].tolist()]
+        questions.append(' '.join(words[:-1]))  # gen_question drops the last word
+        log_prob_qa.append(log_probs[k, :n].mean().item())
+        entropy_qa.append(entropies[k, :n].sum().item() / (n + 1))
+        question_tokens.append(tokens[k, :n].clone())
+    return questions, log_prob_qa, entropy_qa, question_tokens
+
 class Model(nn.Module):
     def __init__(self, dataset, cfg=cfg):
         super(Model, self).__init__()
@@ -48,20 +132,33 @@ class Model(nn.Module):
 
 
     def forward(self, sequences, memory):
-        batch_size = sequences.shape[0]
-        sequence_len = sequences.shape[1]
-        output_seq = torch.empty((sequence_len,
-                                  batch_size,
-                                  self.n_vocab))
+        x_train = self.embedding(sequences)
+        hidden_seq, memory = lstm_sequence(self.lstm, x_train, memory)
+        output_seq = self.fc(self.dropout(hidden_seq))
 
-        for t in range(sequence_len):
-            output_seq[t], memory = self.process_single_input(sequences[:,t], memory)
-
-
-        output_seq = rearrange(output_seq, "seq_len batch_size v_size -> (batch_size seq_len) v_size" )
+        output_seq = rearrange(output_seq, "batch_size seq_len v_size -> (batch_size seq_len) v_size" )
 
         return output_seq, memory
 
+    def replay(self, tokens, lengths, memory):
+        """
+        teacher-forced re-run of a batch of sampled questions
+        tokens: (batch, max_len) sampled token ids, zero padded after lengths
+        returns the mean log prob of each question and the hidden state after its last token
+        """
+        batch_size, max_len = tokens.shape
+        sos = torch.full((batch_size, 1), self.dataset.word_to_index['<sos>'], dtype=torch.long)
+        inputs = torch.cat((sos, tokens[:, :-1]), 1)
+
+        hidden, _ = lstm_sequence(self.lstm, self.embedding(inputs), memory)
+        logits = self.fc(self.dropout(hidden))
+        log_probs = logits.log_softmax(-1).gather(2, tokens.unsqueeze(-1)).squeeze(-1)
+
+        mask = torch.arange(max_len).unsqueeze(0) < lengths.unsqueeze(1)
+        log_probs = (log_probs * mask).sum(1) / lengths
+        last_hidden_state = hidden[torch.arange(batch_size), lengths - 1]
+        return log_probs, last_hidden_state
+
     def init_state(self, batch_size):
         return (torch.rand(batch_size, self.lstm_size),
                 torch.rand(batch_size, self.lstm_size))
@@ -2,16 +2,18 @@ import argparse
 import torch
 import numpy as np
 from torch import nn, optim
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, BatchSampler, SequentialSampler
 from .model import Model
 from .dataset import Dataset
 
 def train(dataset, model, cfg):
     model.train()
 
+    # Whole batches of windows are indexed at once, no per-item collation
     dataloader = DataLoader(
         dataset,
-        batch_size=cfg.batch_size,
+        batch_size=None,
+        sampler=BatchSampler(SequentialSampler(dataset), cfg.batch_size, drop_last=True),
     )
 
     criterion = nn.CrossEntropyLoss()
@@ -21,12 +23,10 @@ def train(dataset, model, cfg):
         state_h, state_c = model.init_state(cfg.batch_size)
 
         for batch, (x, y) in enumerate(dataloader):
-            if y.shape[0] < cfg.batch_size: continue
-
             optimizer.zero_grad()
 
             y_pred, (state_h, state_c) = model(x, (state_h, state_c))
-            loss = criterion(y_pred, y.view(-1))
+            loss = criterion(y_pred, y.reshape(-1))
 
             state_h = state_h.detach()
             state_c = state_c.detach()
@@ -4,6 +4,8 @@ import torch
 
 import torch.nn as nn
 
+from language_model.model import lstm_segments
+
 device = 'cpu'
 
 class BaselineModel(nn.Module):
@@ -72,3 +74,11 @@ class BaselineModelExpMem(BaselineModel):
         encoded_obs = self.encode_obs(obs)
         x = torch.cat((encoded_obs, action), 1)
         return self.memory_rnn(x, memory)
+
+    def replay_memory(self, obs, action, hidden_hist_mem, cell_hist_mem, starts):
+        '''
+        recompute the history memory before every step of a rollout with gradients,
+        one memory_rnn pass per BPTT segment, each from its stored state
+        '''
+        x = torch.cat((self.encode_obs(obs), action), 1)
+        return lstm_segments(self.memory_rnn, x, hidden_hist_mem, cell_hist_mem, starts)
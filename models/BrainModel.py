@@ -67,8 +67,7 @@ class BrainNet(nn.Module):
         observations and actions
         so, this ALREADY in a sense gives the agent a concept of memory
         '''
-        encoded_obs = self.encode_obs(obs)
-        hx = torch.cat((encoded_obs, encoded_memory.view(-1, self.mem_hidden_dim)), 1)
+        hx = self.question_memory(obs, encoded_memory)
         cx = torch.randn(hx.shape).to(device)  # (batch, hidden_size)
         entropy_qa = 0
         log_probs_qa = []
@@ -93,7 +92,25 @@ class BrainNet(nn.Module):
         last_hidden_state = memory[0]
         output = words[1:-1]  # remove sos and eos
 
-        return output, last_hidden_state, log_probs_qa, entropy_qa
+        # sampled ids and initial cell state, enough to replay the question at update time
+        tokens = torch.tensor([self.question_rnn.dataset.word_to_index[word] for word in words[1:]])
+
+        return output, last_hidden_state, log_probs_qa, entropy_qa, (tokens, cx)
+
+    def replay_question(self, obs, encoded_memory, cx, tokens, lengths):
+        '''
+        re-run a batch of questions sampled by gen_question, rebuilding
+        the graph for the log probs and last hidden state in one pass
+        '''
+        hx = self.question_memory(obs, encoded_memory)
+        return self.question_rnn.replay(tokens, lengths, (hx, cx))
+
+    def question_memory(self, obs, encoded_memory):
+        '''
+        initial hidden state of the question rnn, the encoded obs next to the history memory
+        '''
+        encoded_obs = self.encode_obs(obs)
+        return torch.cat((encoded_obs, encoded_memory.view(-1, self.mem_hidden_dim)), 1)
 
     def encode_obs(self, obs):
         x = obs.view(-1, 3, 7, 7)  # x: (batch, C_in, H_in, W_in)
@@ -107,10 +124,12 @@ class BrainNetMem(BrainNet):
         self.memory_rnn = nn.LSTMCell(self.cnn_encoding_dim  + action_dim + 2 + self.hidden_q_dim,
                                       self.mem_hidden_dim)
 
-    def remember(self, obs, action, answer, hidden_q, memory):
+    def memory_inputs(self, obs, action, answer, hidden_q):
         encoded_obs = self.encode_obs(obs)
-        x = torch.cat((encoded_obs, action, answer, hidden_q), 1)
-        return self.memory_rnn(x, memory)
+        return torch.cat((encoded_obs, action, answer, hidden_q), 1)
+
+    def remember(self, obs, action, answer, hidden_q, memory):
+        return self.memory_rnn(self.memory_inputs(obs, action, answer, hidden_q), memory)
 
     def policy(self, obs, answer, hidden_q, hidden_hist_mem):
         """
@@ -193,8 +212,7 @@ class BrainNetExpMemEmbed(BrainNetMem):
         and note that the question_rnn takes as an input a history of your
         observations and actions
         '''
-        encoded_obs = self.encode_obs(obs)
-        hx = torch.cat((encoded_obs, encoded_memory.view(-1, self.mem_hidden_dim)), 1)
+        hx = self.question_memory(obs, encoded_memory)
         cx = torch.randn(hx.shape).to(device)  # (batch, hidden_size)
         entropy_qa = 0
         log_probs_qa = []
@@ -221,5 +239,16 @@ class BrainNetExpMemEmbed(BrainNetMem):
 
         embedding = self.emebed_question(words[1:])
 
-        return output, last_hidden_state, log_probs_qa, entropy_qa, embedding
+        # sampled ids and initial cell state, enough to replay the question at update time
+        tokens = torch.tensor([self.question_rnn.dataset.word_to_index[word] for word in words[1:]])
+
+        return output, last_hidden_state, log_probs_qa, entropy_qa, embedding, (tokens, cx)
+
+    def embed_questions(self, tokens, lengths):
+        '''
+        batched emebed_question over zero padded token ids
+        '''
+        mask = (torch.arange(tokens.shape[1]).unsqueeze(0) < lengths.unsqueeze(1)).unsqueeze(-1)
+        embeddings = self.question_rnn.embedding(tokens) * mask
+        return embeddings.sum(1) / lengths.unsqueeze(1)
 
@@ -71,8 +71,7 @@ class FilmNet(nn.Module):
         observations and actions
         so, this ALREADY in a sense gives the agent a concept of memory
         '''
-        encoded_obs = self.encode_obs(obs).view(-1, self.image_conv_dim * 4)
-        hx = torch.cat((encoded_obs, encoded_memory.view(-1, self.mem_hidden_dim)), 1)
+        hx = self.question_memory(obs, encoded_memory)
         cx = torch.randn(hx.shape).to(device)  # (batch, hidden_size)
         entropy_qa = 0
         log_probs_qa = []
@@ -97,7 +96,25 @@ class FilmNet(nn.Module):
         last_hidden_state = memory[0]
         output = words[1:-1]  # remove sos and eos
 
-        return output, last_hidden_state, log_probs_qa, entropy_qa
+        # sampled ids and initial cell state, enough to replay the question at update time
+        tokens = torch.tensor([self.question_rnn.dataset.word_to_index[word] for word in words[1:]])
+
+        return output, last_hidden_state, log_probs_qa, entropy_qa, (tokens, cx)
+
+    def replay_question(self, obs, encoded_memory, cx, tokens, lengths):
+        '''
+        re-run a batch of questions sampled by gen_question, rebuilding
+        the graph for the log probs and last hidden state in one pass
+        '''
+        hx = self.question_memory(obs, encoded_memory)
+        return self.question_rnn.replay(tokens, lengths, (hx, cx))
+
+    def question_memory(self, obs, encoded_memory):
+        '''
+        initial hidden state of the question rnn, the encoded obs next to the history memory
+        '''
+        encoded_obs = self.encode_obs(obs).view(-1, self.image_conv_dim * 4)
+        return torch.cat((encoded_obs, encoded_memory.view(-1, self.mem_hidden_dim)), 1)
 
     def encode_obs(self, obs):
         x = obs.view(-1, 3, 7, 7)  # x: (batch, C_in, H_in, W_in)
@@ -141,14 +158,16 @@ class FilmNet(nn.Module):
         state_value = self.value_head(x)
         return state_value
 
-    def remember(self, obs, action, answer, hidden_q, memory):
+    def memory_inputs(self, obs, action, answer, hidden_q):
 
         encoded_obs = self.encode_obs(obs)
         conditioned_state = self.film_net(encoded_obs, hidden_q, answer)
         conditioned_state = conditioned_state.view(-1, self.image_conv_dim *4)
 
-        x = torch.cat((conditioned_state, action, answer, hidden_q), 1)
-        return self.memory_rnn(x, memory)
+        return torch.cat((conditioned_state, action, answer, hidden_q), 1)
+
+    def remember(self, obs, action, answer, hidden_q, memory):
+        return self.memory_rnn(self.memory_inputs(obs, action, answer, hidden_q), memory)
 
 
 
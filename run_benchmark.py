@@ -0,0 +1,71 @@
+import argparse
+import os
+import sys
+import yaml
+from utils import get_storage_dir
+from utils.benchmark import run_benchmarks, compare, save_report, load_report
+
+parser = argparse.ArgumentParser(description='Benchmark the throughput of every model config')
+parser.add_argument('-c', '--config',
+                       metavar='config',
+                       type=str,
+                       default='./benchmark_config.yaml',
+                       help='the benchmark config path')
+
+parser.add_argument('--steps',
+                       dest='steps',
+                       type=int,
+                       help='timed env steps per config and env, overrides the benchmark config')
+
+parser.add_argument('--baseline',
+                       dest='baseline',
+                       type=str,
+                       help='report to compare against, overrides the benchmark config')
+
+parser.add_argument('--threshold',
+                       dest='threshold',
+                       type=float,
+                       help='fraction of throughput a case may lose before it counts as a regression')
+
+parser.add_argument('--save-baseline',
+                       dest='save_baseline',
+                       action='store_true',
+                       help='store this run as the new baseline instead of comparing against it')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    with open(args.config, 'r') as file:
+        bench = yaml.safe_load(file)
+
+    steps = args.steps if args.steps is not None else bench["steps"]
+    baseline_path = args.baseline if args.baseline is not None else bench["baseline"]
+    threshold = args.threshold if args.threshold is not None else bench.get("threshold", 0.1)
+
+    print(f'Benchmarking {len(bench["configs"])} configs on {len(bench["envs"])} envs, '
+          f'{steps} steps, best of {bench.get("repeats", 1)} runs each')
+    report = run_benchmarks(bench["configs"], bench["envs"], steps, bench.get("warmup_steps", 0),
+                            bench.get("seed", 0), bench.get("threads", 1), bench.get("repeats", 1))
+
+    for case in report["cases"]:
+        slowest = sorted(case["phases"].items(), key=lambda item: -item[1]["total_ms"])[:3]
+        phases = ", ".join(f"{name} {stats['total_ms'] / case['steps']:.2f}" for name, stats in slowest)
+        print(f"{case['config']} {case['env']}: {case['steps_per_sec']:.1f} steps/sec, "
+              f"{case['updates_per_sec']:.2f} updates/sec, {case['peak_rss_mb']:.0f} MB peak RSS, "
+              f"ms per step: {phases}")
+
+    path = os.path.join(get_storage_dir(), "benchmark.json")
+    save_report(report, path)
+    print(f"Benchmark saved to {path}")
+
+    if args.save_baseline:
+        save_report(report, baseline_path)
+        print(f"Baseline saved to {baseline_path}")
+    elif os.path.exists(baseline_path):
+        regressions = compare(report, load_report(baseline_path), threshold)
+        for case, metric, old, new in regressions:
+            print(f"Regression in {case}: {metric} {old:.2f} -> {new:.2f} ({new / old - 1:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {threshold:.0%} against {baseline_path}")
+    else:
+        print(f"No baseline at {baseline_path}, run with --save-baseline to store one")
@@ -1,8 +1,18 @@
+import copy
+import json
+import multiprocessing as mp
+import os
 import pprint
-from utils import load_yaml_config
+import queue
+from utils import load_yaml_config, get_model_dir, get_storage_dir
 from utils.Trainer import train_test
+from utils.actor_learner import train_test_actor_learner
 from utils.agent import set_up_agent, load_agent, save_agent
 from utils.env import make_oracle_envs
+from utils.parallel import run_parallel
+from utils.population import make_population, train_test_population
+from utils.distributed import init_distributed, is_main_process, make_distributed
+import torch.distributed as dist
 from dataclasses import asdict
 import wandb
 import argparse
@@ -58,10 +68,64 @@ parser.add_argument('--episodes',
                        type=int,
                        help='number of episodes for train and test env runs')
 
-def run_experiment(cfg):
+parser.add_argument('--resume',
+                       dest='resume',
+                       action='store_true',
+                       help='continue train and test runs from their last checkpoint')
+
+parser.add_argument('--workers',
+                       dest='workers',
+                       type=int,
+                       default=1,
+                       help='number of experiments to run at once, each pinned to its own cores')
+
+parser.add_argument('--profile',
+                       dest='profile_episodes',
+                       type=int,
+                       help='run this many training episodes under torch.profiler, trace saved with the model')
+
+parser.add_argument('--population',
+                       dest='population',
+                       type=int,
+                       default=0,
+                       help='train this many seeds as one vectorized population in this process')
+
+parser.add_argument('--world-size',
+                       dest='world_size',
+                       type=int,
+                       default=1,
+                       help='data-parallel processes per machine, gradients are averaged over all of them')
+
+parser.add_argument('--nodes',
+                       dest='nodes',
+                       type=int,
+                       default=1,
+                       help='machines taking part in data-parallel training')
+
+parser.add_argument('--node-rank',
+                       dest='node_rank',
+                       type=int,
+                       default=0,
+                       help='index of this machine, the one with index 0 logs and saves')
+
+parser.add_argument('--master-addr',
+                       dest='master_addr',
+                       type=str,
+                       default='127.0.0.1',
+                       help='address of the machine with node rank 0')
+
+parser.add_argument('--master-port',
+                       dest='master_port',
+                       type=int,
+                       default=29500,
+                       help='free port on the machine with node rank 0')
+
+def run_experiment(cfg, resume=False):
 
     cfg.ans_random = False
-    if cfg.wandb:
+    # With data-parallel training only rank 0 logs, checkpoints and saves
+    main = is_main_process()
+    if cfg.wandb and main:
         run = wandb.init(project='ask_before_you_act', config=asdict(cfg), reinit=True)
         logger = wandb
     else:
@@ -70,28 +134,50 @@ def run_experiment(cfg):
     # Env
     env_train, env_test = make_oracle_envs(cfg)
 
+    train_reward, test_reward = None, None
+
     # Agent
     if cfg.load:
         agent = load_agent(cfg.name)
     else:
         agent = set_up_agent(cfg)
 
+    if dist.is_initialized():
+        make_distributed(agent)
+
     if cfg.train_episodes:
         # Train
-        print(f"============================ Train | No. Episodes {cfg.train_episodes:.0f} ============================")
-        train_reward = train_test(env_train, agent, cfg, logger, n_episodes=cfg.train_episodes,
-                              log_interval=cfg.train_log_interval, train=True, verbose=True, test_env=False)
-        save_agent(agent, cfg, cfg.name)
+        if main:
+            print(f"============================ Train | No. Episodes {cfg.train_episodes:.0f} ============================")
+        if cfg.n_actors:
+            train_reward = train_test_actor_learner(agent, cfg, logger, n_episodes=cfg.train_episodes,
+                                                    log_interval=cfg.train_log_interval, train=True,
+                                                    verbose=True, test_env=False)
+        else:
+            train_reward = train_test(env_train, agent, cfg, logger, n_episodes=cfg.train_episodes,
+                                  log_interval=cfg.train_log_interval, train=True, verbose=main, test_env=False,
+                                  checkpoint_dir=get_model_dir(cfg.name) if main else None, resume=resume)
+        if main:
+            save_agent(agent, cfg, cfg.name)
 
     # Test normal
     if cfg.test_episodes:
-        print(
-            f"============================ Test | No. Episodes {cfg.test_episodes:.0f} ============================")
-        test_reward = train_test(env_test, agent, cfg, logger, n_episodes=cfg.test_episodes,
-                                  log_interval=cfg.train_log_interval, train=True, verbose=True, test_env=True)
-        save_agent(agent, cfg, cfg.name + '-test')
-
-    if cfg.wandb: run.finish()
+        if main:
+            print(
+                f"============================ Test | No. Episodes {cfg.test_episodes:.0f} ============================")
+        if cfg.n_actors:
+            test_reward = train_test_actor_learner(agent, cfg, logger, n_episodes=cfg.test_episodes,
+                                                   log_interval=cfg.train_log_interval, train=True,
+                                                   verbose=True, test_env=True)
+        else:
+            test_reward = train_test(env_test, agent, cfg, logger, n_episodes=cfg.test_episodes,
+                                      log_interval=cfg.train_log_interval, train=True, verbose=main, test_env=True,
+                                      checkpoint_dir=get_model_dir(cfg.name + '-test') if main else None,
+                                      resume=resume)
+        if main:
+            save_agent(agent, cfg, cfg.name + '-test')
+
+    if cfg.wandb and main: run.finish()
 
     return train_reward, test_reward
 
@@ -104,6 +190,7 @@ def random_experiment(cfg):
     else:
         logger = None
 
+    test_reward = None
     agent = load_agent(cfg.name)
     _, env_test = make_oracle_envs(cfg)
 
@@ -116,6 +203,69 @@ def random_experiment(cfg):
 
     if cfg.wandb: run.finish()
 
+    return test_reward
+
+def run_repeat(cfg, ans_random=False, resume=False):
+    train_reward, test_reward = run_experiment(cfg, resume)
+    random_reward = None
+    if not cfg.baseline and ans_random:
+        random_reward = random_experiment(cfg)
+    return {"name": cfg.name, "seed": cfg.seed, "train_reward": train_reward,
+            "test_reward": test_reward, "test_random_reward": random_reward}
+
+def run_population(cfg, n_agents):
+    population, envs_train, envs_test = make_population(cfg, n_agents)
+    train_reward, test_reward = [None] * n_agents, [None] * n_agents
+
+    if cfg.train_episodes:
+        print(f"============================ Train | {n_agents} seeds | No. Episodes {cfg.train_episodes:.0f} ============================")
+        train_reward = train_test_population(envs_train, population, cfg, n_episodes=cfg.train_episodes,
+                                             log_interval=cfg.train_log_interval, train=True, verbose=True)
+        for k, agent in enumerate(population.agents):
+            save_agent(agent, cfg, f"{cfg.name}-{k}")
+
+    if cfg.test_episodes:
+        print(f"============================ Test | {n_agents} seeds | No. Episodes {cfg.test_episodes:.0f} ============================")
+        test_reward = train_test_population(envs_test, population, cfg, n_episodes=cfg.test_episodes,
+                                            log_interval=cfg.train_log_interval, train=True, verbose=True)
+        for k, agent in enumerate(population.agents):
+            save_agent(agent, cfg, f"{cfg.name}-{k}-test")
+
+    return [{"name": f"{cfg.name}-{k}", "seed": cfg.seed + k, "train_reward": train_reward[k],
+             "test_reward": test_reward[k], "test_random_reward": None} for k in range(n_agents)]
+
+def run_rank(local_rank, cfg, args, results):
+    rank = args.node_rank * args.world_size + local_rank
+    init_distributed(rank, args.nodes * args.world_size, args.master_addr, args.master_port)
+
+    # Same weights on every rank, different episodes
+    cfg = copy.copy(cfg)
+    cfg.seed = cfg.seed + rank
+    train_reward, test_reward = run_experiment(cfg)
+    if rank == 0:
+        results.put({"name": cfg.name, "seed": cfg.seed, "train_reward": train_reward,
+                     "test_reward": test_reward, "test_random_reward": None})
+    dist.destroy_process_group()
+
+def run_data_parallel(cfg, args):
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    processes = [ctx.Process(target=run_rank, args=(local_rank, cfg, args, results))
+                 for local_rank in range(args.world_size)]
+    for process in processes:
+        process.start()
+
+    result = None
+    while args.node_rank == 0 and result is None:
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            if any(process.exitcode for process in processes):
+                raise RuntimeError("a data-parallel rank failed")
+
+    for process in processes:
+        process.join()
+    return result
 
 if __name__ == "__main__":
     args = parser.parse_args()
@@ -136,10 +286,37 @@ if __name__ == "__main__":
     if args.epsisodes is not None:
         cfg.test_episodes = cfg.train_episodes = args.epsisodes
 
+    if args.profile_episodes is not None:
+        cfg.profile_episodes = args.profile_episodes
+
     print(f'Running {args.number_of_experiments} experiments')
     pprint.pprint(cfg)
 
+    # One seed per repeat, parallel repeats also get their own storage names
+    repeat_cfgs = []
     for i in range(args.number_of_experiments):
-        run_experiment(cfg)
-        if not cfg.baseline and args.ans_random:
-            random_experiment(cfg)
+        repeat_cfg = copy.copy(cfg)
+        repeat_cfg.seed = cfg.seed + i
+        if args.workers > 1:
+            repeat_cfg.name = f"{cfg.name}-{i}"
+        repeat_cfgs.append(repeat_cfg)
+
+    data_parallel = args.world_size > 1 or args.nodes > 1
+    if data_parallel and (args.resume or args.workers > 1 or args.population or cfg.n_actors):
+        raise ValueError("data-parallel training runs without --resume, --workers, --population or n_actors")
+
+    if args.population:
+        results = run_population(cfg, args.population)
+    elif data_parallel:
+        results = [run_data_parallel(c, args) for c in repeat_cfgs]
+    elif args.workers > 1:
+        results = run_parallel(run_repeat, [(c, args.ans_random, args.resume) for c in repeat_cfgs], args.workers)
+    else:
+        results = [run_repeat(c, args.ans_random, args.resume) for c in repeat_cfgs]
+
+    if args.node_rank == 0:
+        results_path = os.path.join(get_storage_dir(), f"{cfg.name}-rewards.json")
+        os.makedirs(get_storage_dir(), exist_ok=True)
+        with open(results_path, 'w') as file:
+            json.dump(results, file)
+        print(f"Reward histories saved to {results_path}")
@@ -0,0 +1,48 @@
+import argparse
+import os
+from utils import get_storage_dir
+from utils.model_benchmark import MODELS, run_model_benchmarks, save_rows
+
+parser = argparse.ArgumentParser(description='Time the model methods forward and backward at many batch sizes')
+parser.add_argument('--models',
+                       dest='models',
+                       nargs='+',
+                       default=list(MODELS),
+                       choices=list(MODELS),
+                       help='models to benchmark, all by default')
+
+parser.add_argument('--batch-sizes',
+                       dest='batch_sizes',
+                       nargs='+',
+                       type=int,
+                       default=[1, 4, 16, 64, 256, 1024],
+                       help='batch sizes to time every method at')
+
+parser.add_argument('--threads',
+                       dest='threads',
+                       nargs='+',
+                       type=int,
+                       default=[1, os.cpu_count()],
+                       help='torch thread counts to time every method with')
+
+parser.add_argument('--min-time',
+                       dest='min_run_time',
+                       type=float,
+                       default=0.2,
+                       help='seconds each measurement runs for at least')
+
+parser.add_argument('-o', '--output',
+                       dest='output',
+                       type=str,
+                       help='path of the results without extension, .json and .csv are written')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    threads = sorted(set(args.threads))
+    print(f'Timing {len(args.models)} models at batch sizes {args.batch_sizes} with {threads} threads')
+
+    rows = run_model_benchmarks(args.models, args.batch_sizes, threads, args.min_run_time)
+
+    path = args.output if args.output is not None else os.path.join(get_storage_dir(), "model_benchmark")
+    save_rows(rows, path)
+    print(f"Results saved to {path}.json and {path}.csv")
@@ -0,0 +1,46 @@
+import argparse
+import pprint
+import yaml
+from utils import load_yaml_config
+from utils.sweep import sample_configs, rung_budgets, successive_halving, save_sweep
+
+parser = argparse.ArgumentParser(description='Run a local hyperparameter sweep with successive halving')
+parser.add_argument('-c', '--config',
+                       metavar='config',
+                       type=str,
+                       default='./sweep_config.yaml',
+                       help='the sweep config path')
+
+parser.add_argument('--workers',
+                       dest='workers',
+                       type=int,
+                       default=1,
+                       help='number of trials to run at once, each pinned to its own cores')
+
+parser.add_argument('--trials',
+                       dest='n_trials',
+                       type=int,
+                       help='number of sampled configurations, overrides the sweep config')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    with open(args.config, 'r') as file:
+        sweep = yaml.safe_load(file)
+
+    cfg = load_yaml_config(sweep["base"])
+    n_trials = args.n_trials if args.n_trials is not None else sweep["n_trials"]
+    eta = sweep.get("eta", 2)
+    budgets = rung_budgets(sweep["min_episodes"], sweep["max_episodes"], eta)
+
+    print(f'Sweeping {n_trials} trials over {list(sweep["parameters"])}, rungs at {budgets} episodes')
+    pprint.pprint(sweep["parameters"])
+
+    configs = sample_configs(cfg, sweep["parameters"], n_trials, sweep.get("seed", 0))
+    records = successive_halving(configs, budgets, eta, sweep.get("window", 100), args.workers)
+
+    best = max(records, key=lambda record: (len(record["scores"]), record["scores"][max(record["scores"])]))
+    print(f"Best trial {best['name']}:")
+    pprint.pprint({name: best["config"][name] for name in sweep["parameters"]})
+
+    path = save_sweep(records, cfg.name)
+    print(f"Sweep results saved to {path}")
@@ -0,0 +1,36 @@
+import pytest
+
+from utils import load_yaml_config
+from utils.actor_learner import train_test_actor_learner
+from utils.agent import set_up_agent
+
+
+def small_config(**overrides):
+    cfg = load_yaml_config("main_config.yaml")
+    cfg.wandb = False
+    cfg.train_env_name = cfg.test_env_name = "Synthetic-8x8-T10"
+    for name, value in overrides.items():
+        setattr(cfg, name, value)
+    return cfg
+
+
+def run_actors(cfg, n_episodes=4):
+    agent = set_up_agent(cfg)
+    return train_test_actor_learner(agent, cfg, n_episodes=n_episodes, log_interval=n_episodes, verbose=False)
+
+
+def test_actor_learner_trains_with_two_actors():
+    assert len(run_actors(small_config(n_actors=2))) == 4
+
+
+def test_inference_server_trains_with_two_env_workers():
+    assert len(run_actors(small_config(n_actors=2, inference_server=True))) == 4
+
+
+def test_actor_learner_fails_when_actors_die():
+    # An env name make_env cannot build kills every actor at startup
+    cfg = small_config(n_actors=2)
+    agent = set_up_agent(cfg)
+    cfg.train_env_name = "Synthetic-not-an-env"
+    with pytest.raises(RuntimeError, match="actor processes exited"):
+        train_test_actor_learner(agent, cfg, n_episodes=4, log_interval=4, verbose=False)
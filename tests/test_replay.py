@@ -0,0 +1,43 @@
+import torch
+
+from agents.PPOAgent import PPOAgent
+from utils.replay import vtrace
+
+
+def on_policy_agent(gamma=0.99, lmbda=0.95):
+    agent = PPOAgent()
+    agent.gamma, agent.lmbda = gamma, lmbda
+    agent.replaying = False
+    return agent
+
+
+def test_vtrace_on_policy_is_gae():
+    torch.manual_seed(0)
+    steps = 12
+    reward, V = torch.rand(steps), torch.rand(steps)
+    not_done = torch.ones(steps)
+    not_done[-1] = 0
+    next_V = torch.cat((V[1:], torch.zeros(1)))
+
+    agent = on_policy_agent()
+    target, advantage = agent.advantages(reward, not_done, V, next_V, None, None)
+    vtrace_target, vtrace_advantage = vtrace(reward, not_done, V, next_V, torch.ones(steps),
+                                             agent.gamma, agent.lmbda)
+
+    assert torch.allclose(vtrace_target, target)
+    assert torch.allclose(vtrace_advantage, advantage)
+
+
+def test_vtrace_cuts_traces_at_zero_ratio():
+    torch.manual_seed(0)
+    steps = 6
+    reward, V = torch.rand(steps), torch.rand(steps)
+    not_done = torch.ones(steps)
+    next_V = torch.cat((V[1:], torch.zeros(1)))
+    rho = torch.ones(steps)
+    rho[3] = 0
+
+    _, advantage = vtrace(reward, not_done, V, next_V, rho, 0.99, 0.95)
+    delta = reward + 0.99 * next_V - V
+    # Nothing after the action with no probability under the current policy is traced back past it
+    assert torch.isclose(advantage[2, 0], delta[2])
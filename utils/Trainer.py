@@ -1,9 +1,14 @@
+import os
 import time
 import numpy as np
 from collections import namedtuple
 import torch
 import wandb
 
+from utils.checkpoint import AsyncCheckpointer, load_checkpoint, restore, snapshot
+from utils.profiling import EpisodeProfiler
+from utils.timing import NullTimer, make_timer
+
 
 Transition = namedtuple(
     "Transition",
@@ -22,102 +27,155 @@ Transition = namedtuple(
         "q_embedding",
         "hidden_hist_mem",
         "cell_hist_mem",
+        "question_tokens",
+        "cell_q",
     ],
 )
 
+inference_mode = getattr(torch, "inference_mode", torch.no_grad)
+
 class DummyLogger:
     def log(self, *args):
         pass
 
 
-def train_test(env, agent, cfg, logger=None, n_episodes=1000,
-               log_interval=50, train=True, verbose=True, test_env=False):
-    episode = 0
-
-    episode_reward = []
-    episode_qa_reward = []
-    loss_history = []
-    reward_history = []
-
-    state = env.reset()['image']  # Discard other info
-    step = 0
-
-    avg_syntax_r = 0
-
-    qa_pairs = []
-
-    # Initialize random memory
-    hist_mem = agent.init_memory()
-    last_time = time.time()
-
-    if logger is None:
-        logger = DummyLogger()
-
-    while episode < n_episodes:
+def rollout_step(env, agent, cfg, state, hist_mem, timer=NullTimer()):
+    """
+    one ask, act, remember and env step with the agent's acting model, each timed as a phase of timer
+    returns the transition, next state, next history memory and the [question, answer, reward] asked
+    """
+    # Acting needs no autograd, the learner replays what it needs in update
+    with inference_mode():
         # Ask before you act
         if cfg.baseline:
-            action, log_prob_act, entropy_act = agent.act(state, hist_mem[0])
+            with timer.phase("act"):
+                action, log_prob_act, entropy_act = agent.act(state, hist_mem[0])
             answer, reward_qa, entropy_qa = (1, 0, 1)
+            qa_pair = None
             log_prob_qa = 6 * [torch.Tensor([1])]
 
             #dummy not to break transtition
             hidden_q = torch.ones(128)
             q_embedding = torch.ones(128)
+            question_tokens, cell_q = torch.zeros(1, dtype=torch.long), torch.ones(1, 128)
 
         elif cfg.q_embed:
 
             # Ask
-            question, hidden_q, log_prob_qa, entropy_qa, q_embedding = agent.ask(state, hist_mem[0])
-            answer, reward_qa = env.answer(question)
+            with timer.phase("ask"):
+                question, hidden_q, log_prob_qa, entropy_qa, q_embedding, (question_tokens, cell_q) = \
+                    agent.ask(state, hist_mem[0])
+            with timer.phase("answer"):
+                answer, reward_qa = env.answer(question)
 
             # Logging
-            episode_qa_reward.append(reward_qa)
-            qa_pairs.append([question, str(answer), reward_qa])  # Storing
+            qa_pair = [question, str(answer), reward_qa]
 
             # Answer
             answer = answer.encode()  # For passing vector to agent
-            avg_syntax_r += 1 / log_interval * (reward_qa - avg_syntax_r)
 
-            action, log_prob_act, entropy_act = agent.act(state, answer, hidden_q, hist_mem[0], q_embedding)
+            with timer.phase("act"):
+                action, log_prob_act, entropy_act = agent.act(state, answer, hidden_q, hist_mem[0], q_embedding)
 
         else:
             # Ask
-
-            question, hidden_q, log_prob_qa, entropy_qa = agent.ask(state, hist_mem[0])
-            answer, reward_qa = env.answer(question)
+            with timer.phase("ask"):
+                question, hidden_q, log_prob_qa, entropy_qa, (question_tokens, cell_q) = agent.ask(state, hist_mem[0])
+            with timer.phase("answer"):
+                answer, reward_qa = env.answer(question)
 
             # Logging
-            episode_qa_reward.append(reward_qa)
-            qa_pairs.append([question, str(answer), reward_qa])  # Storing
+            qa_pair = [question, str(answer), reward_qa]
 
             # Answer
             answer = answer.encode()  # For passing vector to agent
-            avg_syntax_r += 1 / log_interval * (reward_qa - avg_syntax_r)
 
-            action, log_prob_act, entropy_act = agent.act(state, answer, hidden_q, hist_mem[0])
+            with timer.phase("act"):
+                action, log_prob_act, entropy_act = agent.act(state, answer, hidden_q, hist_mem[0])
 
             #dummy not to break transtition
             q_embedding = torch.ones(128)
 
         # Remember
         if cfg.use_mem:  # need to make this work for baseline also
-            if cfg.baseline:
-                next_hist_mem = agent.remember(state, action, hist_mem)
-            else:
-                next_hist_mem = agent.remember(state, action, answer, hidden_q, hist_mem)
+            with timer.phase("remember"):
+                if cfg.baseline:
+                    next_hist_mem = agent.remember(state, action, hist_mem)
+                else:
+                    next_hist_mem = agent.remember(state, action, answer, hidden_q, hist_mem)
         else:
             next_hist_mem = agent.init_memory()
 
-        # Step
+    # Step
+    with timer.phase("env_step"):
         next_state, reward, done, _ = env.step(action)
-        next_state = next_state['image']  # Discard other info
+    next_state = next_state['image']  # Discard other info
+
+    # Store
+    t = Transition(state, answer, hidden_q, action, reward, reward_qa,
+                   log_prob_act.item(), torch.stack(log_prob_qa).mean().item(), entropy_act.item(),
+                   entropy_qa, done, q_embedding, hist_mem[0], hist_mem[1], question_tokens, cell_q)
 
-        # Store
-        t = Transition(state, answer, hidden_q, action, reward, reward_qa,
-                       log_prob_act.item(), log_prob_qa, entropy_act.item(), entropy_qa, done, q_embedding,
-                       hist_mem[0], hist_mem[1])
+    return t, next_state, next_hist_mem, qa_pair
 
-        agent.store(t)
+
+def train_test(env, agent, cfg, logger=None, n_episodes=1000,
+               log_interval=50, train=True, verbose=True, test_env=False,
+               checkpoint_dir=None, resume=False):
+    episode = 0
+
+    episode_reward = []
+    episode_qa_reward = []
+    loss_history = []
+    reward_history = []
+
+    # Periodic checkpoints, written in the background
+    checkpointer = None
+    if checkpoint_dir is not None and cfg.checkpoint_interval:
+        checkpointer = AsyncCheckpointer(checkpoint_dir)
+
+    if checkpoint_dir is not None and resume:
+        checkpoint = load_checkpoint(checkpoint_dir)
+        if checkpoint is not None:
+            episode, reward_history = restore(agent, env, checkpoint)
+            if verbose:
+                print(f"Resuming from episode {episode}")
+
+    state = env.reset()['image']  # Discard other info
+    step = 0
+
+    avg_syntax_r = 0
+
+    qa_pairs = []
+
+    # Initialize random memory
+    hist_mem = agent.init_memory()
+    last_time = time.time()
+
+    if logger is None:
+        logger = DummyLogger()
+
+    # Per-phase wall times, reported every log interval next to the checkpoints
+    timer = make_timer(cfg, os.path.join(checkpoint_dir, "timing.jsonl") if checkpoint_dir is not None else None)
+
+    # A window of training episodes under torch.profiler, its trace and op tables also go next to the checkpoints
+    profiler = None
+    if checkpoint_dir is not None and cfg.profile_episodes and train and not test_env:
+        profiler = EpisodeProfiler(cfg, agent, checkpoint_dir)
+        timer = profiler.timer(timer)
+
+    while episode < n_episodes:
+        t, next_state, next_hist_mem, qa_pair = rollout_step(env, agent, cfg, state, hist_mem, timer)
+        reward, done = t.reward, t.done
+
+        if qa_pair is not None:
+            # Logging
+            episode_qa_reward.append(t.reward_qa)
+            qa_pairs.append(qa_pair)  # Storing
+            avg_syntax_r += 1 / log_interval * (t.reward_qa - avg_syntax_r)
+
+        with timer.phase("store"):
+            agent.store(t)
 
         # Advance
         state = next_state
@@ -130,22 +188,24 @@ def train_test(env, agent, cfg, logger=None, n_episodes=1000,
         if done:
 
             # Update
-            if train and len(agent.data) >= 2:
-                episode_loss, losses_tuple = agent.update()
-                loss_history.append(episode_loss)
-            else:
-                episode_loss, losses_tuple = (0, (0, 0, 0, 0, 0))
-
-            # Reset episode
-            state = env.reset()['image']  # Discard other info
-            hist_mem = agent.init_memory()  # Initialize memory
-            step = 0
+            with timer.phase("update"):
+                if train and len(agent.data) >= 2:
+                    episode_loss, losses_tuple = agent.update()
+                    agent.replay()
+                    agent.sync_actor()
+                    loss_history.append(episode_loss)
+                else:
+                    if train:
+                        agent.skip_update()
+                        agent.sync_actor()
+                    episode_loss, losses_tuple = (0, (0, 0, 0, 0, 0))
 
             reward_history.append(sum(episode_reward))
 
             if cfg.wandb:
-                log_cases(logger, cfg, episode, episode_loss, losses_tuple, episode_qa_reward,
-                          episode_reward, qa_pairs, reward_history, train, test_env)
+                with timer.phase("logging"):
+                    log_cases(logger, cfg, episode, episode_loss, losses_tuple, episode_qa_reward,
+                              episode_reward, qa_pairs, reward_history, train, test_env)
 
             episode_reward = []
             episode_qa_reward = []
@@ -153,6 +213,19 @@ def train_test(env, agent, cfg, logger=None, n_episodes=1000,
 
             episode += 1
 
+            if profiler is not None:
+                profiler.step()
+
+            if checkpointer is not None and episode % cfg.checkpoint_interval == 0:
+                with timer.phase("checkpoint"):
+                    checkpointer.save(snapshot(agent, env, cfg, episode, reward_history))
+
+            # Reset episode, after the checkpoint, so a resumed run draws the same next episode from the restored RNGs
+            if episode < n_episodes:
+                state = env.reset()['image']  # Discard other info
+                hist_mem = agent.init_memory()  # Initialize memory
+                step = 0
+
             if episode % log_interval == 0:
                 current_time = time.time()
                 if verbose:
@@ -160,9 +233,20 @@ def train_test(env, agent, cfg, logger=None, n_episodes=1000,
                     print(f"Episode: {episode}, Reward: {avg_R:.2f}, Avg. Reward Question {avg_syntax_r:.3f}, "
                           f"Episodes/sec: {log_interval / (current_time - last_time):.1f} ")
                     # print("+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++")
+                timer.report(episode, logger if cfg.wandb else None)
                 avg_syntax_r = 0
                 last_time = current_time
 
+    # Whatever ran since the last log interval
+    timer.report(episode, logger if cfg.wandb else None)
+
+    if profiler is not None:
+        profiler.close()
+
+    if checkpointer is not None:
+        checkpointer.save(snapshot(agent, env, cfg, episode, reward_history))
+        checkpointer.close()
+
     return reward_history
 
 
@@ -0,0 +1,161 @@
+import copy
+import multiprocessing as mp
+import queue
+import time
+import numpy as np
+
+from utils.Trainer import DummyLogger, log_cases, rollout_step
+from utils.inference_server import start_inference_server
+from utils.parallel import core_groups, pin_cores
+from utils.shared_weights import SharedWeights
+
+
+def actor_loop(cfg, actor_id, cores, weights, trajectory_queue, stop_event, test_env=False):
+    """
+    actor process: play whole episodes with the latest weights it got and send them to the learner
+    """
+    # Imported here, so spawned actors pay for agents and gym only once they run
+    from utils.agent import set_up_agent
+    from utils.env import make_oracle_envs
+
+    pin_cores(cores)
+    # Unsent episodes are worthless once the learner stops, do not block exit on them
+    trajectory_queue.cancel_join_thread()
+
+    cfg = copy.copy(cfg)
+    cfg.seed = cfg.seed + actor_id + 1  # The learner's own seed is cfg.seed
+    cfg.use_seed = True
+    envs = make_oracle_envs(cfg)
+    env = envs[1] if test_env else envs[0]
+    agent = set_up_agent(cfg)
+    version = None
+
+    while not stop_event.is_set():
+        # Weights are published before the actors start, so the first load always succeeds
+        new_version = weights.load(agent.model)
+        if new_version is not None:
+            version = new_version
+            agent.sync_actor()
+
+        state = env.reset()['image']  # Discard other info
+        hist_mem = agent.init_memory()
+        transitions, qa_pairs = [], []
+        done = False
+        while not done:
+            t, state, hist_mem, qa_pair = rollout_step(env, agent, cfg, state, hist_mem)
+            transitions.append(t)
+            if qa_pair is not None:
+                qa_pairs.append(qa_pair)
+            done = t.done
+
+        while not stop_event.is_set():
+            try:
+                trajectory_queue.put((actor_id, version, transitions, qa_pairs), timeout=0.1)
+                break
+            except queue.Full:
+                pass
+
+
+def next_episode(trajectory_queue, actors, timeout=1.0):
+    """
+    the next episode an actor sent, raises once any actor process has exited instead of waiting forever
+    """
+    while True:
+        try:
+            return trajectory_queue.get(timeout=timeout)
+        except queue.Empty:
+            exited = [actor for actor in actors if not actor.is_alive()]
+            if exited:
+                raise RuntimeError("actor processes exited: " +
+                                   ", ".join(f"{actor.name} with code {actor.exitcode}" for actor in exited))
+
+
+def train_test_actor_learner(agent, cfg, logger=None, n_episodes=1000, log_interval=50,
+                             train=True, verbose=True, test_env=False):
+    """
+    train_test with acting spread over cfg.n_actors processes and learning in this one,
+    with cfg.inference_server the actors only step envs and one server process runs the model for all
+    episodes collected more than cfg.max_staleness updates ago are dropped, within that bound
+    the PPO ratio against the stored behaviour probs corrects for the policy lag
+    """
+    ctx = mp.get_context("spawn")
+    n_actors = cfg.n_actors
+
+    # The learner keeps the first core group to itself
+    groups = core_groups(n_actors + 1 + cfg.inference_server)[1:]
+
+    stop_event = ctx.Event()
+    trajectory_queue = ctx.Queue(maxsize=n_actors)
+
+    # Actors copy new weights out of shared memory, nothing is pickled per update
+    version = 0
+    weights = SharedWeights(agent.model)
+    weights.publish(agent.model, version)
+
+    if cfg.inference_server:
+        actors, _channels = start_inference_server(ctx, cfg, groups, weights, trajectory_queue,
+                                                   stop_event, test_env)
+    else:
+        actors = [ctx.Process(target=actor_loop, daemon=True,
+                              args=(cfg, i, groups[i], weights, trajectory_queue, stop_event, test_env))
+                  for i in range(n_actors)]
+        for actor in actors:
+            actor.start()
+
+    if logger is None:
+        logger = DummyLogger()
+
+    episode = 0
+    n_stale = 0
+    reward_history = []
+    avg_syntax_r = 0
+    last_time = time.time()
+
+    try:
+        while episode < n_episodes:
+            actor_id, actor_version, transitions, qa_pairs = next_episode(trajectory_queue, actors)
+
+            if train and version - actor_version > cfg.max_staleness:
+                n_stale += 1
+                continue
+
+            if train and len(transitions) >= 2:
+                agent.data = list(transitions)
+                episode_loss, losses_tuple = agent.update()
+                agent.replay()
+                agent.sync_actor()
+                version += 1
+                if version % cfg.actor_sync_interval == 0:
+                    weights.publish(agent.model, version)
+            else:
+                episode_loss, losses_tuple = (0, (0, 0, 0, 0, 0))
+
+            episode_reward = [t.reward for t in transitions]
+            episode_qa_reward = [t.reward_qa for t in transitions]
+            reward_history.append(sum(episode_reward))
+            if qa_pairs:
+                avg_syntax_r += 1 / log_interval * (np.mean(episode_qa_reward) - avg_syntax_r)
+
+            if cfg.wandb:
+                log_cases(logger, cfg, episode, episode_loss, losses_tuple, episode_qa_reward,
+                          episode_reward, qa_pairs, reward_history, train, test_env)
+
+            episode += 1
+
+            if episode % log_interval == 0:
+                current_time = time.time()
+                if verbose:
+                    avg_R = np.mean(reward_history[-log_interval:])
+                    print(f"Episode: {episode}, Reward: {avg_R:.2f}, Avg. Reward Question {avg_syntax_r:.3f}, "
+                          f"Episodes/sec: {log_interval / (current_time - last_time):.1f}, "
+                          f"Stale episodes dropped: {n_stale} ")
+                avg_syntax_r = 0
+                last_time = current_time
+    finally:
+        stop_event.set()
+        for actor in actors:
+            actor.join(timeout=10)
+            if actor.is_alive():
+                actor.terminate()
+
+    return reward_history
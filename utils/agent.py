@@ -1,3 +1,4 @@
+import copy
 from agents.BaselineAgent import BaselineAgentExpMem, BaselineAgent
 from agents.MainAgent import AgentExpMem, AgentMem, Agent, AgentExpMemEmbed
 from models.BaselineModel import BaselineModelExpMem, BaselineModel
@@ -5,6 +6,10 @@ from models.BrainModel import BrainNetExpMem, BrainNetMem, BrainNet, BrainNetExp
 from language_model import Dataset, Model as QuestionRNN
 import utils
 from models.FilmModel import FilmNet
+from utils.compiled import compile_model
+from utils.quantize import DynamicQuantizer
+from utils.replay import ReplayBuffer
+from utils.onnx_backend import OnnxExporter
 
 def save_agent(agent, cfg, name):
     model_dir = utils.get_model_dir(name)
@@ -16,11 +21,14 @@ def save_agent(agent, cfg, name):
 
 def load_agent(name):
     model_dir = utils.get_model_dir(name)
-    config = utils.get_config(model_dir)
+    # One read of status.pt for both the config and the weights
+    status = utils.get_status(model_dir)
+    config = copy.copy(status["config"])
     dataset = Dataset(config)
     question_rnn = QuestionRNN(dataset, config)
     agent = set_up_agent(config, question_rnn)
-    agent.model.load_state_dict(utils.get_model_state(model_dir))
+    agent.model.load_state_dict(status["model_state"])
+    agent.sync_actor()
     return agent
 
 
@@ -32,13 +40,14 @@ def set_up_agent(cfg, question_rnn=None):
         question_rnn = QuestionRNN(dataset, cfg)
 
         if cfg.pre_trained_lstm:
-            question_rnn.load('./language_model/pre-trained.pth')
+            question_rnn.load_state_dict(utils.load_checkpoint('./language_model/pre-trained.pth'))
 
     if cfg.baseline:
         if cfg.use_mem:
             model = BaselineModelExpMem()
             agent = BaselineAgentExpMem(model, cfg.lr, cfg.lmbda, cfg.gamma, cfg.clip,
                                         cfg.value_param, cfg.entropy_act_param)
+            agent.mem_bptt = cfg.mem_bptt
 
         else:
             model = BaselineModel()
@@ -81,4 +90,27 @@ def set_up_agent(cfg, question_rnn=None):
                           cfg.policy_qa_param, cfg.advantage_qa_param,
                           cfg.entropy_qa_param)
 
+        # Only the explicit memory policies read the history memory
+        if cfg.use_mem and cfg.exp_mem:
+            agent.mem_bptt = cfg.mem_bptt
+
+    if cfg.replay_size:
+        agent.replay_buffer = ReplayBuffer(cfg.replay_size, cfg.seed)
+        agent.replay_ratio = cfg.replay_ratio
+        agent.vtrace_clip = cfg.vtrace_clip
+
+    set_up_actor(agent, cfg.actor_backend)
+    compile_model(agent.model, cfg.compile_mode)
+
     return agent
+
+
+def set_up_actor(agent, backend):
+    if backend == "int8":
+        agent.actor_transform = DynamicQuantizer(agent.model)
+    elif backend == "onnx":
+        agent.actor_transform = OnnxExporter()
+    elif backend != "torch":
+        raise ValueError(f"unknown actor backend: {backend}")
+
+    agent.sync_actor()
@@ -0,0 +1,213 @@
+import gym
+import numpy as np
+from gym import spaces
+from gym_minigrid.minigrid import DIR_TO_VEC, OBJECT_TO_IDX, STATE_TO_IDX
+
+from utils.synthetic_env import SyntheticGrid, VIEW_SIZE, EMPTY, WALL as WALL_CELL
+
+PAD = VIEW_SIZE - 1
+WALL, DOOR, GOAL, LAVA = (OBJECT_TO_IDX[name] for name in ['wall', 'door', 'goal', 'lava'])
+OPEN, CLOSED, LOCKED = STATE_TO_IDX['open'], STATE_TO_IDX['closed'], STATE_TO_IDX['locked']
+DIRS = np.array(DIR_TO_VEC)
+# Cells the agent walks onto, open doors too
+OVERLAP = [OBJECT_TO_IDX[name] for name in ['empty', 'floor', 'goal', 'lava']]
+# Nothing is ever carried, layouts with objects to pick up are not simulated
+CARRIED = [OBJECT_TO_IDX[name] for name in ['key', 'ball', 'box']]
+
+
+def view_offsets():
+    """
+    (4, 7, 7, 2) offsets from the agent of the cells at view (x, y) for every direction,
+    the inverse of MiniGrid's get_view_coords, the agent at (3, 6) facing up the view
+    """
+    offsets = np.zeros((4, VIEW_SIZE, VIEW_SIZE, 2), dtype=int)
+    vx, vy = np.meshgrid(np.arange(VIEW_SIZE), np.arange(VIEW_SIZE), indexing='ij')
+    for d, (dx, dy) in enumerate(DIR_TO_VEC):
+        rx, ry = -dy, dx
+        offsets[d, ..., 0] = dx * (VIEW_SIZE - 1 - vy) + rx * (vx - VIEW_SIZE // 2)
+        offsets[d, ..., 1] = dy * (VIEW_SIZE - 1 - vy) + ry * (vx - VIEW_SIZE // 2)
+    return offsets
+
+
+VIEW_OFFSETS = view_offsets()
+
+
+def visibility(images):
+    """
+    MiniGrid's process_vis for a (n, 7, 7, 3) batch of views, one row at a time from the agent's,
+    light spreads along the row through cells it can see behind and then to the three cells above each
+    """
+    see_behind = ~((images[..., 0] == WALL) | ((images[..., 0] == DOOR) & (images[..., 2] != OPEN)))
+    mask = np.zeros(images.shape[:3], dtype=bool)
+    mask[:, VIEW_SIZE // 2, VIEW_SIZE - 1] = True
+
+    for j in reversed(range(VIEW_SIZE)):
+        row = mask[:, :, j]
+        for i in range(VIEW_SIZE - 1):
+            row[:, i + 1] |= row[:, i] & see_behind[:, i, j]
+        for i in reversed(range(1, VIEW_SIZE)):
+            row[:, i - 1] |= row[:, i] & see_behind[:, i, j]
+
+        if j > 0:
+            lit = row & see_behind[:, :, j]
+            above = mask[:, :, j - 1]
+            above |= lit
+            above[:, 1:] |= lit[:, :-1]
+            above[:, :-1] |= lit[:, 1:]
+    return mask
+
+
+class GridEnvView(gym.Env):
+    """
+    env index of a BatchedGridEnv as a single gym env, with the grid and agent position OracleWrapper reads
+    stepping it steps only this env
+    """
+    metadata = {'render.modes': []}
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+        self.observation_space = batch.observation_space
+        self.action_space = batch.action_space
+
+    @property
+    def grid(self):
+        return SyntheticGrid(self.batch.grids[self.index])
+
+    @property
+    def agent_pos(self):
+        return tuple(self.batch.agent_pos[self.index])
+
+    @property
+    def agent_dir(self):
+        return int(self.batch.agent_dir[self.index])
+
+    @property
+    def mission(self):
+        return self.batch.missions[self.index]
+
+    def seed(self, seed=None):
+        return self.batch.generators[self.index].seed(seed)
+
+    def reset(self):
+        return self.batch.obs(self.index, self.batch.reset([self.index])[0])
+
+    def step(self, action):
+        images, rewards, dones = self.batch.step([action], [self.index])
+        return self.batch.obs(self.index, images[0]), float(rewards[0]), bool(dones[0]), {}
+
+
+class BatchedGridEnv:
+    """
+    n_envs MiniGrid envs of one MultiRoom or Empty-Random layout stepped together with NumPy ops
+    the grids are one (n_envs, width, height, 3) array in Grid.encode's layout, with agent positions, directions
+    and step counts beside it, views, occlusion, moves, door toggles and rewards are computed for all envs at once
+    each env's own gym_minigrid env only generates its layouts on reset, so seeded episodes match it,
+    with level_pool they are copied from its LevelPool instead
+    indexing gives the single env views, make_batched_oracle_envs swaps in their OracleWrappers
+    """
+    def __init__(self, env_name, n_envs, level_pool=0):
+        from utils.env import make_env
+
+        self.generators = [make_env(env_name, level_pool) for _ in range(n_envs)]
+        self.level_pool = level_pool
+        first = self.generators[0].unwrapped
+        if first.agent_view_size != VIEW_SIZE:
+            raise ValueError(f"{env_name} has a {first.agent_view_size}x{first.agent_view_size} view, "
+                             f"only {VIEW_SIZE}x{VIEW_SIZE} is simulated")
+        self.max_steps = first.max_steps
+        self.see_through_walls = first.see_through_walls
+
+        self.observation_space = spaces.Dict({
+            'image': spaces.Box(low=0, high=255, shape=(VIEW_SIZE, VIEW_SIZE, 3), dtype='uint8')
+        })
+        self.action_space = spaces.Discrete(len(first.actions))
+
+        # Walls around every grid, so every view is in bounds, grids is the unpadded part
+        self.padded = np.empty((n_envs, first.width + 2 * PAD, first.height + 2 * PAD, 3), dtype='uint8')
+        self.padded[...] = WALL_CELL
+        self.grids = self.padded[:, PAD:-PAD, PAD:-PAD]
+        self.agent_pos = np.zeros((n_envs, 2), dtype=int)
+        self.agent_dir = np.zeros(n_envs, dtype=int)
+        self.step_count = np.zeros(n_envs, dtype=int)
+        self.missions = [""] * n_envs
+
+        self.envs = [GridEnvView(self, index) for index in range(n_envs)]
+
+    def __len__(self):
+        return len(self.envs)
+
+    def __getitem__(self, index):
+        return self.envs[index]
+
+    def __iter__(self):
+        return iter(self.envs)
+
+    def seed(self, seeds):
+        for generator, seed in zip(self.generators, seeds):
+            generator.seed(seed)
+
+    def reset(self, index=None):
+        """
+        new layouts for the envs at index (all by default), returns their (n, 7, 7, 3) views
+        """
+        index = np.arange(len(self)) if index is None else np.asarray(index)
+        for b in index:
+            generator = self.generators[b]
+            env = generator.unwrapped
+            if self.level_pool:
+                encoded, (x, y, direction) = generator.next_level()
+            else:
+                generator.reset()
+                encoded, (x, y), direction = env.grid.encode(), env.agent_pos, env.agent_dir
+            if np.isin(encoded[..., 0], CARRIED).any():
+                raise ValueError("layouts with objects to pick up are not simulated")
+            self.grids[b] = encoded
+            self.agent_pos[b] = x, y
+            self.agent_dir[b] = direction
+            self.missions[b] = env.mission
+        self.step_count[index] = 0
+        return self.gen_obs(index)
+
+    def gen_obs(self, index):
+        pos, dirs = self.agent_pos[index], self.agent_dir[index]
+        cells = pos[:, None, None] + VIEW_OFFSETS[dirs] + PAD
+        images = self.padded[index[:, None, None], cells[..., 0], cells[..., 1]]
+        if not self.see_through_walls:
+            images[~visibility(images)] = 0
+        images[:, VIEW_SIZE // 2, VIEW_SIZE - 1] = EMPTY  # The agent carries nothing
+        return images
+
+    def obs(self, index, image):
+        return {'image': image, 'direction': int(self.agent_dir[index]), 'mission': self.missions[index]}
+
+    def step(self, actions, index=None):
+        """
+        MiniGrid's step for the envs at index (all by default),
+        pickup and drop find nothing to move and locked doors stay shut without a key
+        returns their (n, 7, 7, 3) views, rewards and dones, done envs are not reset
+        """
+        index = np.arange(len(self)) if index is None else np.asarray(index)
+        actions = np.asarray(actions)
+        self.step_count[index] += 1
+
+        dirs = self.agent_dir[index]
+        front = self.agent_pos[index] + DIRS[dirs]
+        cells = self.padded[index, front[:, 0] + PAD, front[:, 1] + PAD]
+        kind, state = cells[:, 0], cells[:, 2]
+
+        self.agent_dir[index] = np.where(actions == 0, (dirs - 1) % 4, np.where(actions == 1, (dirs + 1) % 4, dirs))
+
+        forward = actions == 2
+        move = forward & (np.isin(kind, OVERLAP) | ((kind == DOOR) & (state == OPEN)))
+        self.agent_pos[index[move]] = front[move]
+
+        toggle = (actions == 5) & (kind == DOOR) & (state != LOCKED)
+        toggled = np.where(state == OPEN, CLOSED, OPEN)
+        self.padded[index[toggle], front[toggle, 0] + PAD, front[toggle, 1] + PAD, 2] = toggled[toggle]
+
+        goal = forward & (kind == GOAL)
+        steps = self.step_count[index]
+        rewards = np.where(goal, 1 - 0.9 * (steps / self.max_steps), 0)
+        dones = goal | (forward & (kind == LAVA)) | (steps >= self.max_steps)
+        return self.gen_obs(index), rewards, dones
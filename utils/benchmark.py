@@ -0,0 +1,131 @@
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import time
+import torch
+
+from utils.config import load_yaml_config
+from utils.storage import create_folders_if_necessary
+from utils.timing import PhaseTimer
+
+
+def benchmark_case(config_path, env_name, steps, warmup_steps, seed, threads):
+    """
+    run a config for warmup_steps and then steps timed env steps on one env, learning at every episode end
+    as train_test does, returns steps/sec, updates/sec, peak RSS and the time per phase
+    """
+    # Imported here, so the parent process never loads gym or the agents
+    from utils.agent import set_up_agent
+    from utils.env import make_oracle_envs
+    from utils.Trainer import rollout_step
+
+    torch.set_num_threads(threads)
+    cfg = load_yaml_config(config_path)
+    cfg.train_env_name = env_name
+    cfg.seed = seed
+    cfg.use_seed = True
+    cfg.wandb = False
+
+    env = make_oracle_envs(cfg)[0]
+    agent = set_up_agent(cfg)
+    timer = PhaseTimer()
+
+    state = env.reset()['image']  # Discard other info
+    hist_mem = agent.init_memory()
+    n_updates = 0
+    start = time.perf_counter()
+
+    for step in range(warmup_steps + steps):
+        if step == warmup_steps:
+            timer.reset()
+            n_updates = 0
+            start = time.perf_counter()
+
+        t, state, hist_mem, _ = rollout_step(env, agent, cfg, state, hist_mem, timer)
+        with timer.phase("store"):
+            agent.store(t)
+
+        if t.done:
+            with timer.phase("update"):
+                if len(agent.data) >= 2:
+                    agent.update()
+                    agent.replay()
+                    agent.sync_actor()
+                    n_updates += 1
+            state = env.reset()['image']
+            hist_mem = agent.init_memory()
+
+    elapsed = time.perf_counter() - start
+    return {
+        "config": config_path,
+        "env": env_name,
+        "steps": steps,
+        "seed": seed,
+        "updates": n_updates,
+        "seconds": elapsed,
+        "steps_per_sec": steps / elapsed,
+        "updates_per_sec": n_updates / elapsed,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "phases": timer.summary(),
+    }
+
+
+def run_benchmarks(configs, envs, steps, warmup_steps=0, seed=0, threads=1, repeats=1):
+    """
+    benchmark_case repeats times for every config and env, one run after another,
+    each in a fresh process so peak RSS and warm caches are its own
+    every case keeps its fastest run, the least disturbed by the rest of the machine
+    """
+    cases = [(config, env, steps, warmup_steps, seed, threads) for config in configs for env in envs]
+    ctx = mp.get_context("spawn")
+    with ctx.Pool(1, maxtasksperchild=1) as pool:
+        runs = pool.starmap(benchmark_case, [case for case in cases for _ in range(repeats)])
+
+    results = []
+    for i in range(len(cases)):
+        case_runs = runs[i * repeats:(i + 1) * repeats]
+        best = dict(max(case_runs, key=lambda run: run["steps_per_sec"]))
+        best["runs_steps_per_sec"] = [run["steps_per_sec"] for run in case_runs]
+        results.append(best)
+
+    return {
+        "machine": {"platform": platform.platform(), "processor": platform.processor(),
+                    "cpus": os.cpu_count(), "torch": torch.__version__, "threads": threads},
+        "time": time.time(),
+        "cases": results,
+    }
+
+
+def case_key(case):
+    # Update counts depend on where the seeded episodes end, only runs of the same length and seed compare
+    return f"{case['config']} {case['env']} ({case['steps']} steps, seed {case['seed']})"
+
+
+def compare(report, baseline, threshold):
+    """
+    the cases of report whose steps/sec or updates/sec fell more than threshold (a fraction) below baseline
+    returns a list of (case, metric, baseline value, new value), cases the baseline has no run of are skipped
+    """
+    old_cases = {case_key(case): case for case in baseline["cases"]}
+    regressions = []
+    for case in report["cases"]:
+        old = old_cases.get(case_key(case))
+        if old is None:
+            continue
+        for metric in ("steps_per_sec", "updates_per_sec"):
+            if old[metric] and case[metric] < (1 - threshold) * old[metric]:
+                regressions.append((case_key(case), metric, old[metric], case[metric]))
+    return regressions
+
+
+def save_report(report, path):
+    create_folders_if_necessary(path)
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+
+
+def load_report(path):
+    with open(path, "r") as file:
+        return json.load(file)
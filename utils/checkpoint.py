@@ -0,0 +1,112 @@
+import copy
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+
+from utils.storage import create_folders_if_necessary, torch_load
+
+
+def get_checkpoint_path(model_dir):
+    return os.path.join(model_dir, "checkpoint.pt")
+
+
+def agent_optimizers(agent):
+    optimizers = [agent.optimizer]
+    if hasattr(agent, "optimizer_qa"):
+        optimizers.append(agent.optimizer_qa)
+    return optimizers
+
+
+def get_env_rng_state(env):
+    # Older gym seeds with a RandomState, newer with a Generator
+    rng = env.unwrapped.np_random
+    if hasattr(rng, "bit_generator"):
+        return rng.bit_generator.state
+    return rng.get_state()
+
+
+def set_env_rng_state(env, state):
+    # In place, the env's RNG object has to keep its class
+    rng = env.unwrapped.np_random
+    if hasattr(rng, "bit_generator"):
+        rng.bit_generator.state = state
+    else:
+        rng.set_state(state)
+
+
+def snapshot(agent, env, cfg, episode, reward_history):
+    """
+    copy of everything train_test needs to resume, safe to write while training continues
+    """
+    return {
+        "model_state": {k: v.detach().clone() for k, v in agent.model.state_dict().items()},
+        "optimizer_states": [copy.deepcopy(o.state_dict()) for o in agent_optimizers(agent)],
+        "rng_states": {
+            "torch": torch.get_rng_state(),
+            "numpy": np.random.get_state(),
+            "random": random.getstate(),
+            "env": get_env_rng_state(env),
+        },
+        "episode": episode,
+        "reward_history": list(reward_history),
+        "config": cfg,
+    }
+
+
+def restore(agent, env, checkpoint):
+    """
+    load a snapshot back into the agent, its optimizers and the RNGs
+    returns the episode counter and reward history to continue from
+    """
+    agent.model.load_state_dict(checkpoint["model_state"])
+    for optimizer, state in zip(agent_optimizers(agent), checkpoint["optimizer_states"]):
+        optimizer.load_state_dict(state)
+    agent.sync_actor()
+
+    rng_states = checkpoint["rng_states"]
+    torch.set_rng_state(rng_states["torch"])
+    np.random.set_state(rng_states["numpy"])
+    random.setstate(rng_states["random"])
+    set_env_rng_state(env, rng_states["env"])
+
+    return checkpoint["episode"], list(checkpoint["reward_history"])
+
+
+def load_checkpoint(model_dir):
+    path = get_checkpoint_path(model_dir)
+    if not os.path.exists(path):
+        return None
+    return torch_load(path, mmap=False)
+
+
+def save_atomic(status, path):
+    create_folders_if_necessary(path)
+    tmp_path = path + ".tmp"
+    torch.save(status, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class AsyncCheckpointer:
+    """
+    write checkpoints from a background thread, with an atomic rename into the model dir
+    at most one write is in flight, a new save waits for the previous one
+    """
+    def __init__(self, model_dir):
+        self.path = get_checkpoint_path(model_dir)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+
+    def save(self, status):
+        self.wait()
+        self.pending = self.executor.submit(save_atomic, status, self.path)
+
+    def wait(self):
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
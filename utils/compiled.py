@@ -0,0 +1,73 @@
+import warnings
+import torch
+
+# Methods the agents call at every environment step
+COMPILED_METHODS = ["encode_obs", "policy", "value", "remember"]
+
+# Leaf modules torch.jit.script can take as they are
+SCRIPTED_MODULES = ["image_conv", "memory_rnn", "policy_head", "value_head"]
+SCRIPTED_QUESTION_MODULES = ["embedding", "lstm", "fc"]
+
+
+class EagerFallback:
+    """
+    call a compiled function, dropping back to the eager one for good the first time it fails
+    """
+    def __init__(self, compiled, eager, name):
+        self.compiled = compiled
+        self.eager = eager
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        if self.compiled is not None:
+            try:
+                return self.compiled(*args, **kwargs)
+            except Exception as e:
+                warnings.warn(f"compiled {self.name} failed, falling back to eager: {e}")
+                self.compiled = None
+        return self.eager(*args, **kwargs)
+
+
+def compile_model(model, mode="eager"):
+    """
+    swap the per-step computation of an agent model for a compiled one
+    mode: eager (no-op), compile (torch.compile of the methods) or script (torch.jit.script of the layers)
+    parameters are shared with the eager model, so optimizers and state dicts are unaffected
+    """
+    if mode == "eager":
+        return model
+
+    if mode == "compile":
+        if not hasattr(torch, "compile"):
+            warnings.warn(f"torch {torch.__version__} has no torch.compile, running eager")
+            return model
+        compile_methods(model, COMPILED_METHODS)
+        if hasattr(model, "question_rnn"):
+            compile_methods(model.question_rnn, ["process_single_input"])
+
+    elif mode == "script":
+        script_modules(model, SCRIPTED_MODULES)
+        if hasattr(model, "question_rnn"):
+            script_modules(model.question_rnn, SCRIPTED_QUESTION_MODULES)
+
+    else:
+        raise ValueError(f"unknown compile mode: {mode}")
+
+    return model
+
+
+def compile_methods(module, names):
+    for name in names:
+        if hasattr(module, name):
+            eager = getattr(module, name)
+            compiled = torch.compile(eager, dynamic=True)
+            setattr(module, name, EagerFallback(compiled, eager, f"{type(module).__name__}.{name}"))
+
+
+def script_modules(module, names):
+    for name in names:
+        if hasattr(module, name):
+            try:
+                setattr(module, name, torch.jit.script(getattr(module, name)))
+            except Exception as e:
+                warnings.warn(f"could not script {type(module).__name__}.{name}, running eager: {e}")
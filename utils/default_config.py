@@ -17,6 +17,9 @@ class Config:
     clip: float = 0.2
     entropy_act_param: float = 0.1
     value_param: float = 1
+    replay_size: int = 0  # past episodes kept for off-policy updates, 0 to learn from each episode once
+    replay_ratio: int = 1  # replayed updates after each update on a new episode
+    vtrace_clip: float = 1.0  # truncation of the importance weights of replayed episodes
 
     policy_qa_param: float = 0.25
     advantage_qa_param: float = 0.25
@@ -28,9 +31,15 @@ class Config:
     train_log_interval: float = 3
     test_log_interval: float = 1
     log_questions: bool = False
+    checkpoint_interval: int = 0  # episodes between checkpoints, 0 to disable
+    timing: bool = False  # per-phase wall times of the training loop, reported every log interval
+    profile_episodes: int = 0  # episodes of the training loop run under torch.profiler, 0 to disable
+    profile_skip: int = 1  # episodes before the profiled ones, the profiler also warms up on one more
 
     train_env_name: str =  "MiniGrid-MultiRoom-N2-S4-v0"
     test_env_name: str = "MiniGrid-MultiRoom-N4-S5-v0"
+    batched_env: bool = False  # step a population's envs as one NumPy batch, MultiRoom and Empty-Random only
+    level_pool: int = 0  # levels per env and seed cached on disk and restored in turn on reset, 0 to generate each
 
     ans_random: float = 0
 
@@ -43,11 +52,23 @@ class Config:
 
     use_mem: bool = True
     use_seed: bool = False
+    seed: int = 0
     exp_mem: bool = True
+    mem_bptt: int = 0  # truncated BPTT window through the memory LSTM in updates, 0 for whole episodes
     baseline: bool = True
     film: bool = False
     q_embed: bool = False
 
+    compile_mode: str = "eager"  # eager, compile or script
+    actor_backend: str = "torch"  # torch, int8 or onnx
+
+    n_actors: int = 0  # acting processes, 0 to act and learn in one loop
+    max_staleness: int = 4  # updates an actor's episode may lag behind the learner
+    actor_sync_interval: int = 1  # updates between weight broadcasts to the actors
+    inference_server: bool = False  # actors only step envs, one process batches their model calls
+    server_max_batch: int = 0  # requests per batch, 0 for one per actor
+    server_max_latency: float = 0.005  # seconds a batch waits for more requests
+
     wandb: bool = True
     notes: str = ""
     load: bool = False
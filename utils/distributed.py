@@ -0,0 +1,52 @@
+import os
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(rank, world_size, master_addr="127.0.0.1", master_port=29500):
+    os.environ["MASTER_ADDR"] = master_addr
+    os.environ["MASTER_PORT"] = str(master_port)
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+
+
+def is_main_process():
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+
+def broadcast_model(model):
+    # Every rank starts from rank 0's weights
+    with torch.no_grad():
+        for tensor in model.state_dict().values():
+            dist.broadcast(tensor, 0)
+
+
+class GradientAllReduce:
+    """
+    agent.reduce_gradients for data-parallel training
+    averages the gradients over the ranks that learned from an episode, in one flat all-reduce,
+    ranks that skipped their update join with no gradient so every rank applies the same step
+    returns False if no rank had a gradient, then nobody steps
+    """
+    def __call__(self, model, contributes=True):
+        params = list(model.parameters())
+        grads = [p.grad if contributes and p.grad is not None else torch.zeros_like(p) for p in params]
+        flat = torch.cat([g.reshape(-1) for g in grads] + [torch.tensor([float(contributes)])])
+        dist.all_reduce(flat)
+
+        contributors = flat[-1].item()
+        if contributors == 0:
+            return False
+
+        flat /= contributors
+        offset = 0
+        for p in params:
+            numel = p.numel()
+            p.grad = flat[offset:offset + numel].view_as(p).clone()
+            offset += numel
+        return True
+
+
+def make_distributed(agent):
+    broadcast_model(agent.model)
+    agent.sync_actor()
+    agent.reduce_gradients = GradientAllReduce()
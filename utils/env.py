@@ -1,45 +1,77 @@
-from gym_minigrid.minigrid import Grid, Goal
+from gym_minigrid.minigrid import COLOR_TO_IDX, OBJECT_TO_IDX, Grid, Goal, Wall, WorldObj
 from gym_minigrid import envs
+import os
 import re
+import shutil
+import tempfile
 import gym
 import gym_minigrid
 import random
 import torch
 import numpy as np
+from gym.utils import seeding
+from numpy.lib.format import open_memmap
 from oracle.oracle import OracleWrapper
+from utils.batched_env import BatchedGridEnv
+from utils.storage import create_folders_if_necessary, get_storage_dir
+from utils.synthetic_env import SyntheticEnv
 
-def make_env(env_name):
+def make_env(env_name, level_pool=0):
     empty_room_match = re.match(r"MiniGrid-Empty-Random-([0-9]+)x[0-9]+", env_name)
+    # Synthetic-8x8 or Synthetic-8x8-T40 for episodes of at most 40 steps
+    synthetic_match = re.match(r"Synthetic-([0-9]+)x[0-9]+(?:-T([0-9]+))?$", env_name)
     if empty_room_match:
         env = EmptyRandomEnv(int(empty_room_match.group(1)))
+    elif synthetic_match:
+        size, max_steps = synthetic_match.groups()
+        env = SyntheticEnv(int(size), int(max_steps or 40))
     else:
         env = gym.make(env_name)
 
+    # The synthetic env replays its own levels already
+    if level_pool and not synthetic_match:
+        env = LevelPoolEnv(env.unwrapped, env_name, level_pool)
+
     return env
 
 
+def seed_everything(seed):
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    random.seed(seed)
+
+
+def oracle_wrap(env, cfg, test_env=False):
+    return OracleWrapper(env, syntax_error_reward=cfg.syntax_error_reward,
+                         undefined_error_reward=cfg.undefined_error_reward,
+                         defined_q_reward=cfg.defined_q_reward_test if test_env else cfg.defined_q_reward,
+                         ans_random=cfg.ans_random)
+
+
 def make_oracle_envs(cfg):
-    env_train = make_env(cfg.train_env_name)
-    env_test = make_env(cfg.test_env_name)
+    env_train = make_env(cfg.train_env_name, cfg.level_pool)
+    env_test = make_env(cfg.test_env_name, cfg.level_pool)
 
     if cfg.use_seed:
         env_test.seed(cfg.seed)
         env_train.seed(cfg.seed)
-        np.random.seed(cfg.seed)
-        torch.manual_seed(cfg.seed)
-        random.seed(cfg.seed)
+        seed_everything(cfg.seed)
 
-    env_train = OracleWrapper(env_train, syntax_error_reward=cfg.syntax_error_reward,
-                              undefined_error_reward=cfg.undefined_error_reward,
-                              defined_q_reward=cfg.defined_q_reward,
-                              ans_random=cfg.ans_random)
+    return oracle_wrap(env_train, cfg), oracle_wrap(env_test, cfg, test_env=True)
 
-    env_test = OracleWrapper(env_test, syntax_error_reward=cfg.syntax_error_reward,
-                             undefined_error_reward=cfg.undefined_error_reward,
-                             defined_q_reward=cfg.defined_q_reward_test,
-                             ans_random=cfg.ans_random)
 
-    return env_train, env_test
+def make_batched_oracle_envs(cfg, seeds):
+    """
+    train and test BatchedGridEnvs of one env per seed, seeded as make_oracle_envs seeds a single env,
+    every env of a batch answers questions through its own OracleWrapper
+    """
+    envs = []
+    for env_name, test_env in [(cfg.train_env_name, False), (cfg.test_env_name, True)]:
+        batch = BatchedGridEnv(env_name, len(seeds), cfg.level_pool)
+        batch.seed(seeds)
+        batch.envs = [oracle_wrap(env, cfg, test_env) for env in batch.envs]
+        envs.append(batch)
+    return tuple(envs)
 
 class EmptyRandomEnv(envs.EmptyEnv):
     def __init__(self, size=20):
@@ -62,4 +94,96 @@ class EmptyRandomEnv(envs.EmptyEnv):
         else:
             self.place_agent()
 
-        self.mission = "get to the green goal square"
\ No newline at end of file
+        self.mission = "get to the green goal square"
+
+
+def decode_grid(encoded):
+    """
+    Grid.decode that skips the empty cells, and the grey walls share one Wall, as they do in MultiRoomEnv._gen_grid
+    """
+    grid = Grid(*encoded.shape[:2])
+    wall = Wall()
+    xs, ys = np.nonzero(encoded[..., 0] > OBJECT_TO_IDX['empty'])
+    for x, y, cell in zip(xs.tolist(), ys.tolist(), encoded[xs, ys].tolist()):
+        if cell[:2] == [OBJECT_TO_IDX['wall'], COLOR_TO_IDX['grey']]:
+            grid.set(x, y, wall)
+        else:
+            grid.set(x, y, WorldObj.decode(*cell))
+    return grid
+
+
+class LevelPool:
+    """
+    n_levels encoded grids and agent start states (x, y, dir) of a MiniGrid env, memory-mapped .npy files in path
+    level i is generated from its own seed, drawn from seed and i, the first time any run needs it and read back after
+    runs may share a pool, its files are built in a temporary folder that is renamed to path once complete
+    """
+    def __init__(self, env, seed, n_levels, path):
+        self.env = env
+        self.seed = seed
+
+        if not os.path.exists(os.path.join(path, "starts.npy")):
+            create_folders_if_necessary(path)
+            tmp = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=".tmp-")
+            open_memmap(os.path.join(tmp, "grids.npy"), mode="w+", dtype="uint8",
+                        shape=(n_levels, env.width, env.height, 3)).flush()
+            # A direction of -1 marks a level not generated yet
+            starts = open_memmap(os.path.join(tmp, "starts.npy"), mode="w+", dtype="int16", shape=(n_levels, 3))
+            starts[:] = -1
+            starts.flush()
+            del starts
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # Another run got there first, use its pool
+                shutil.rmtree(tmp)
+
+        self.grids = np.load(os.path.join(path, "grids.npy"), mmap_mode="r+")
+        self.starts = np.load(os.path.join(path, "starts.npy"), mmap_mode="r+")
+
+    def level(self, i):
+        if self.starts[i, 2] < 0:
+            self.env.seed(int(np.random.SeedSequence([self.seed, i]).generate_state(1)[0]))
+            self.env.reset()
+            self.grids[i] = self.env.grid.encode()
+            self.starts[i, :2] = self.env.agent_pos
+            # Written last, the level counts as generated once its direction is set
+            self.starts[i, 2] = self.env.agent_dir
+        return self.grids[i], self.starts[i]
+
+
+class LevelPoolEnv(gym.Wrapper):
+    """
+    a MiniGrid env whose resets restore the levels of a LevelPool in turn instead of generating new ones
+    the pool belongs to the env name and seed, 1337 until seeded as for MiniGrid envs, and is kept under storage/levels
+    """
+    def __init__(self, env, env_name, n_levels):
+        super().__init__(env)
+        self.env_name = env_name
+        self.n_levels = n_levels
+        self.pool_seed = 1337
+        self.pool = None
+        self.level = 0
+
+    def seed(self, seed=None):
+        _, seed = seeding.np_random(seed)
+        self.pool_seed, self.pool, self.level = seed, None, 0
+        return [seed]
+
+    def next_level(self):
+        if self.pool is None:
+            path = os.path.join(get_storage_dir(), "levels", f"{self.env_name}-seed{self.pool_seed}-{self.n_levels}")
+            self.pool = LevelPool(self.env, self.pool_seed, self.n_levels, path)
+        grid, start = self.pool.level(self.level)
+        self.level = (self.level + 1) % self.n_levels
+        return grid, start
+
+    def reset(self, **kwargs):
+        grid, start = self.next_level()
+        env = self.env
+        env.grid = decode_grid(grid)
+        env.agent_pos = start[:2].astype(int)
+        env.agent_dir = int(start[2])
+        env.carrying = None
+        env.step_count = 0
+        return env.gen_obs()
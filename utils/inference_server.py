@@ -0,0 +1,273 @@
+import copy
+import queue
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.distributions as distributions
+
+from language_model.model import sample_questions, decode_questions
+from utils.Trainer import Transition, inference_mode
+from utils.parallel import pin_cores
+from utils.population import method_args
+
+
+def env_worker(cfg, worker_id, cores, request_queue, response_queue, stop_event, test_env=False):
+    """
+    env process for the inference server, it holds no model
+    sends each observation, gets back a question, sends the oracle's answer, gets back an action
+    """
+    from utils.env import make_oracle_envs
+
+    pin_cores(cores)
+    request_queue.cancel_join_thread()
+
+    cfg = copy.copy(cfg)
+    cfg.seed = cfg.seed + worker_id + 1
+    cfg.use_seed = True
+    envs = make_oracle_envs(cfg)
+    env = envs[1] if test_env else envs[0]
+
+    state = env.reset()['image']  # Discard other info
+    reward, done = None, False
+
+    def request(*message):
+        request_queue.put((worker_id, *message))
+        while not stop_event.is_set():
+            try:
+                return response_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    while not stop_event.is_set():
+        # The reward and done of the previous step travel with the next observation
+        question = request("obs", state, reward, done)
+        if question is None:
+            break
+
+        if not cfg.baseline:
+            answer, reward_qa = env.answer(question)
+            action = request("answer", answer.encode(), reward_qa, [question, str(answer), reward_qa])
+            if action is None:
+                break
+        else:
+            action = question
+
+        state, reward, done, _ = env.step(action)
+        state = state['image']
+        if done:
+            state = env.reset()['image']
+
+
+class InferenceServer:
+    """
+    one agent model acting for many env workers, their requests batched into single calls
+    a batch closes at max_batch requests or max_latency seconds after its first request,
+    the history memory and the open episode of every worker are kept here
+    """
+    def __init__(self, agent, cfg, n_workers, trajectory_queue, max_batch=None, max_latency=0.005):
+        self.agent = agent
+        self.cfg = cfg
+        self.trajectory_queue = trajectory_queue
+        self.max_batch = max_batch or n_workers
+        self.max_latency = max_latency
+        self.version = 0
+        self.stop_event = None
+
+        self.hist_mem = [agent.init_memory() for _ in range(n_workers)]
+        self.episode_version = [0] * n_workers
+        self.transitions = [[] for _ in range(n_workers)]
+        self.qa_pairs = [[] for _ in range(n_workers)]
+        # Ask results waiting for the oracle's answer
+        self.pending = [None] * n_workers
+
+    def next_batch(self, request_queue, stop_event):
+        batch = []
+        while not batch:
+            if stop_event.is_set():
+                return batch
+            try:
+                batch.append(request_queue.get(timeout=0.1))
+            except queue.Empty:
+                pass
+
+        deadline = time.time() + self.max_latency
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(request_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def serve(self, request_queue, response_queues, weights, stop_event):
+        self.stop_event = stop_event
+        while not stop_event.is_set():
+            version = weights.load(self.agent.model)
+            if version is not None:
+                self.version = version
+                self.agent.sync_actor()
+
+            batch = self.next_batch(request_queue, stop_event)
+            with inference_mode():
+                observations = [request for request in batch if request[1] == "obs"]
+                answers = [request for request in batch if request[1] == "answer"]
+                replies = []
+                if observations:
+                    replies += self.on_observations(observations)
+                if answers:
+                    replies += self.on_answers(answers)
+
+            for worker_id, reply in replies:
+                response_queues[worker_id].put(reply)
+
+    def finish_step(self, worker_id, reward, done):
+        # Close the previous step of a worker, and its episode when it ended
+        t = self.transitions[worker_id].pop()
+        self.transitions[worker_id].append(t._replace(reward=reward, done=done))
+        if done:
+            episode = (worker_id, self.episode_version[worker_id], self.transitions[worker_id], self.qa_pairs[worker_id])
+            while not self.stop_event.is_set():
+                try:
+                    self.trajectory_queue.put(episode, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            self.transitions[worker_id], self.qa_pairs[worker_id] = [], []
+            self.hist_mem[worker_id] = self.agent.init_memory()
+
+    def on_observations(self, requests):
+        ids = [worker_id for worker_id, *_ in requests]
+        for worker_id, _, _, reward, done in requests:
+            if reward is not None:
+                self.finish_step(worker_id, reward, done)
+            if not self.transitions[worker_id]:
+                self.episode_version[worker_id] = self.version
+
+        states = [state for _, _, state, _, _ in requests]
+        obs = torch.FloatTensor(np.stack(states))
+        hidden_hist_mem = torch.cat([self.hist_mem[i][0] for i in ids])
+        cell_hist_mem = torch.cat([self.hist_mem[i][1] for i in ids])
+
+        if self.cfg.baseline:
+            inputs = {"obs": obs, "hist_mem": hidden_hist_mem, "memory": (hidden_hist_mem, cell_hist_mem)}
+            actions = self.act(ids, states, inputs, answer=[1] * len(ids), reward_qa=[0] * len(ids),
+                               hidden_q=[torch.ones(128)] * len(ids), log_prob_qa=[1.0] * len(ids),
+                               entropy_qa=[1] * len(ids), q_embedding=torch.ones(len(ids), 128),
+                               question_tokens=[torch.zeros(1, dtype=torch.long)] * len(ids),
+                               cell_q=torch.ones(len(ids), 1, 128))
+            return list(zip(ids, actions))
+
+        model = self.agent.actor_model
+        dataset = model.question_rnn.dataset
+        hx = model.question_memory(obs, hidden_hist_mem)
+        cx = torch.randn(hx.shape)
+        tokens, lengths, log_probs, entropies, hidden_q = sample_questions(
+            model.question_rnn.process_single_input,
+            (hx, cx), dataset.word_to_index['<sos>'], dataset.word_to_index['<eos>'])
+        questions, log_prob_qa, entropy_qa, question_tokens = decode_questions(
+            dataset, tokens, lengths, log_probs, entropies)
+
+        if self.cfg.q_embed:
+            padded = nn.utils.rnn.pad_sequence(question_tokens, batch_first=True)
+            q_embedding = model.embed_questions(padded, lengths)
+        else:
+            q_embedding = torch.ones(len(ids), 128)
+
+        for k, (worker_id, _, state, _, _) in enumerate(requests):
+            self.pending[worker_id] = (state, hidden_q[k:k + 1], log_prob_qa[k], entropy_qa[k],
+                                       q_embedding[k], question_tokens[k], cx[k:k + 1])
+        return list(zip(ids, questions))
+
+    def on_answers(self, requests):
+        ids = [worker_id for worker_id, *_ in requests]
+        pending = [self.pending[i] for i in ids]
+        states, hidden_q, log_prob_qa, entropy_qa, q_embedding, question_tokens, cell_q = zip(*pending)
+
+        for worker_id, _, _, _, qa_pair in requests:
+            self.qa_pairs[worker_id].append(qa_pair)
+
+        answer = [answer for _, _, answer, _, _ in requests]
+        q_embedding = torch.stack(q_embedding)
+        hidden_hist_mem = torch.cat([self.hist_mem[i][0] for i in ids])
+        cell_hist_mem = torch.cat([self.hist_mem[i][1] for i in ids])
+        inputs = {"obs": torch.FloatTensor(np.stack(states)), "answer": torch.FloatTensor(np.stack(answer)),
+                  "hidden_q": torch.cat(hidden_q), "hidden_hist_mem": hidden_hist_mem, "q_embedding": q_embedding,
+                  "memory": (hidden_hist_mem, cell_hist_mem)}
+
+        actions = self.act(ids, states, inputs, answer=answer, reward_qa=[r for _, _, _, r, _ in requests],
+                           hidden_q=hidden_q, log_prob_qa=log_prob_qa, entropy_qa=entropy_qa,
+                           q_embedding=q_embedding, question_tokens=question_tokens, cell_q=cell_q)
+        return list(zip(ids, actions))
+
+    def act(self, ids, states, inputs, answer, reward_qa, hidden_q, log_prob_qa, entropy_qa,
+            q_embedding, question_tokens, cell_q):
+        """
+        batched act and remember, opens one transition per worker, its reward comes with the next obs
+        the keyword arguments hold the rest of each worker's transition
+        """
+        model = self.agent.actor_model
+        logits = model.policy(*method_args(model.policy, inputs))
+        action_prob = F.softmax(logits / self.agent.T, dim=-1)
+        dist = distributions.Categorical(action_prob)
+        action = dist.sample()
+        probs = action_prob.gather(1, action.unsqueeze(1)).squeeze(1)
+        entropy = dist.entropy()
+
+        if self.cfg.use_mem:
+            inputs = dict(inputs, action=F.one_hot(action, 7).float())
+            next_h, next_c = model.remember(*method_args(model.remember, inputs))
+
+        for k, worker_id in enumerate(ids):
+            hist_mem = self.hist_mem[worker_id]
+            self.transitions[worker_id].append(
+                Transition(states[k], answer[k], hidden_q[k],
+                           action[k].item(), 0, reward_qa[k], probs[k].item(), log_prob_qa[k],
+                           entropy[k].item(), entropy_qa[k], False, q_embedding[k], hist_mem[0], hist_mem[1],
+                           question_tokens[k], cell_q[k]))
+            if self.cfg.use_mem:
+                self.hist_mem[worker_id] = (next_h[k:k + 1], next_c[k:k + 1])
+            else:
+                self.hist_mem[worker_id] = self.agent.init_memory()
+
+        return action.tolist()
+
+
+def server_loop(cfg, n_workers, cores, request_queue, response_queues, weights,
+                trajectory_queue, stop_event):
+    """
+    inference server process, episodes go to the learner in the same format actor_loop sends
+    """
+    from utils.agent import set_up_agent
+
+    pin_cores(cores)
+    trajectory_queue.cancel_join_thread()
+
+    agent = set_up_agent(cfg)
+    server = InferenceServer(agent, cfg, n_workers, trajectory_queue,
+                             cfg.server_max_batch, cfg.server_max_latency)
+    server.serve(request_queue, response_queues, weights, stop_event)
+
+
+def start_inference_server(ctx, cfg, groups, weights, trajectory_queue, stop_event, test_env=False):
+    """
+    start the server, reading the learner's SharedWeights, and cfg.n_actors env workers,
+    the server pinned to the first of the core groups and the workers to the rest
+    returns the processes and the request and response queues,
+    which the caller has to keep alive for as long as the processes run
+    """
+    request_queue = ctx.Queue()
+    response_queues = [ctx.Queue() for _ in range(cfg.n_actors)]
+
+    processes = [ctx.Process(target=server_loop, daemon=True,
+                             args=(cfg, cfg.n_actors, groups[0], request_queue, response_queues,
+                                   weights, trajectory_queue, stop_event))]
+    processes += [ctx.Process(target=env_worker, daemon=True,
+                              args=(cfg, i, groups[1 + i], request_queue, response_queues[i], stop_event, test_env))
+                  for i in range(cfg.n_actors)]
+    for process in processes:
+        process.start()
+    return processes, (request_queue, response_queues)
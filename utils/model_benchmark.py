@@ -0,0 +1,139 @@
+import csv
+import json
+import torch
+import torch.nn.functional as F
+from torch.utils import benchmark
+
+from language_model import Dataset, Model as QuestionRNN
+from language_model.model import sample_questions
+from models.BaselineModel import BaselineModelExpMem, BaselineModel
+from models.BrainModel import BrainNetExpMem, BrainNetMem, BrainNet, BrainNetExpMemEmbed
+from models.FilmModel import FilmNet
+from utils.default_config import Config
+from utils.population import method_args
+from utils.storage import create_folders_if_necessary
+
+MODELS = {
+    "BaselineModel": lambda question_rnn: BaselineModel(),
+    "BaselineModelExpMem": lambda question_rnn: BaselineModelExpMem(),
+    "BrainNet": BrainNet,
+    "BrainNetMem": BrainNetMem,
+    "BrainNetExpMem": BrainNetExpMem,
+    "BrainNetExpMemEmbed": BrainNetExpMemEmbed,
+    "FilmNet": FilmNet,
+}
+METHODS = ["encode_obs", "policy", "value", "remember", "gen_question", "sample_questions", "replay_question"]
+# Question methods, timed on models that ask, the samplers only run forward
+QUESTION_METHODS = ["gen_question", "sample_questions", "replay_question"]
+FORWARD_ONLY = ["gen_question", "sample_questions"]
+COLUMNS = ["model", "method", "mode", "batch_size", "threads", "median_ms", "iqr_ms", "per_sample_us"]
+
+
+def make_inputs(model, batch_size):
+    """
+    random inputs for every model method argument, keyed by argument name as method_args picks them
+    """
+    mem = model.mem_hidden_dim
+    memory = (torch.rand(batch_size, mem), torch.rand(batch_size, mem))
+    inputs = {"obs": torch.rand(batch_size, 7, 7, 3), "answer": torch.rand(batch_size, 2),
+              "hidden_q": torch.rand(batch_size, 128), "q_embedding": torch.rand(batch_size, 128),
+              "hidden_hist_mem": memory[0], "hist_mem": memory[0], "encoded_memory": memory[0],
+              "memory": memory, "action": F.one_hot(torch.randint(7, (batch_size,)), 7).float()}
+
+    if hasattr(model, "question_rnn"):
+        # Questions of 2 to 6 tokens, as gen_question samples them
+        vocab = len(model.question_rnn.dataset.word_to_index)
+        inputs["lengths"] = torch.randint(2, 7, (batch_size,))
+        inputs["tokens"] = torch.randint(vocab, (batch_size, 6))
+        with torch.no_grad():
+            inputs["cx"] = torch.randn(model.question_memory(inputs["obs"], memory[0]).shape)
+    return inputs
+
+
+def method_call(model, method, inputs, train):
+    """
+    the call timed for a method, forward only or forward and backward when train
+    sample_questions is the batched sampler the inference server uses in place of gen_question,
+    replay_question the teacher-forced pass of the update
+    """
+    if method == "sample_questions":
+        dataset = model.question_rnn.dataset
+        sos, eos = dataset.word_to_index['<sos>'], dataset.word_to_index['<eos>']
+
+        def fn(obs, encoded_memory):
+            hx = model.question_memory(obs, encoded_memory)
+            return sample_questions(model.question_rnn.process_single_input, (hx, torch.randn(hx.shape)), sos, eos)
+    else:
+        fn = getattr(model, method)
+    args = method_args(fn, inputs)
+
+    if not train:
+        def call():
+            with torch.inference_mode():
+                fn(*args)
+        return call
+
+    def call():
+        outputs = fn(*args)
+        outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+        torch.stack([output.sum() for output in outputs if output.requires_grad]).sum().backward()
+        model.zero_grad(set_to_none=True)
+    return call
+
+
+def benchmark_model(name, model, batch_sizes, threads, min_run_time=0.2):
+    """
+    median time of every method the model has, at every batch size and thread count,
+    forward only and forward with backward, one row per measurement
+    the samplers only run forward, gen_question samples a single question, so only at batch size 1
+    """
+    rows = []
+    for method in METHODS:
+        if method in QUESTION_METHODS and not hasattr(model, "question_memory"):
+            continue
+        if method not in QUESTION_METHODS and not hasattr(model, method):
+            continue
+        for batch_size in batch_sizes:
+            if method == "gen_question" and batch_size != 1:
+                continue
+            inputs = make_inputs(model, batch_size)
+            for mode in ("forward", "backward"):
+                if method in FORWARD_ONLY and mode == "backward":
+                    continue
+                call = method_call(model, method, inputs, train=mode == "backward")
+                for n_threads in threads:
+                    timer = benchmark.Timer(stmt="call()", globals={"call": call}, num_threads=n_threads)
+                    measurement = timer.blocked_autorange(min_run_time=min_run_time)
+                    rows.append({"model": name, "method": method, "mode": mode, "batch_size": batch_size,
+                                 "threads": n_threads, "median_ms": measurement.median * 1e3,
+                                 "iqr_ms": measurement.iqr * 1e3,
+                                 "per_sample_us": measurement.median * 1e6 / batch_size})
+    return rows
+
+
+def run_model_benchmarks(model_names, batch_sizes, threads, min_run_time=0.2, verbose=True):
+    cfg = Config()
+    question_rnn = QuestionRNN(Dataset(cfg), cfg)
+    rows = []
+    for name in model_names:
+        model = MODELS[name](question_rnn)
+        model_rows = benchmark_model(name, model, batch_sizes, threads, min_run_time)
+        if verbose:
+            for row in model_rows:
+                print(f"{row['model']}.{row['method']} {row['mode']} batch {row['batch_size']} "
+                      f"threads {row['threads']}: {row['median_ms']:.3f} ms, {row['per_sample_us']:.1f} us/sample")
+        rows += model_rows
+    return rows
+
+
+def save_rows(rows, path):
+    """
+    write the rows to path.json and path.csv, the same columns in both
+    """
+    create_folders_if_necessary(path + ".json")
+    with open(path + ".json", "w") as file:
+        json.dump({"torch": torch.__version__, "rows": rows}, file, indent=2)
+    with open(path + ".csv", "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,180 @@
+import inspect
+import os
+import shutil
+import tempfile
+import weakref
+import torch
+import torch.nn as nn
+
+# Per-step computation exported for each model, when the model has it
+EXPORTED_METHODS = ["encode_obs", "policy", "remember"]
+
+
+class MethodModule(nn.Module):
+    """
+    wrap one method of an agent model as a forward, with memory tuples flattened to (h, c)
+    """
+    def __init__(self, module, name, memory=False):
+        super().__init__()
+        self.module = module
+        self.name = name
+        self.memory = memory
+
+    def forward(self, *args):
+        if self.memory:
+            *args, h, c = args
+            args = (*args, (h, c))
+        return getattr(self.module, self.name)(*args)
+
+
+def example_inputs(model, name):
+    """
+    batch size 1 inputs for a model method, built from its argument names
+    """
+    mem = torch.zeros(1, model.mem_hidden_dim)
+    shapes = {
+        "obs": torch.zeros(1, 7 * 7 * 3),  # the models view it as (batch, 3, 7, 7)
+        "answer": torch.zeros(1, 2),
+        "action": torch.zeros(1, 7),
+        "hidden_q": torch.zeros(1, getattr(model, "hidden_q_dim", 128)),
+        "q_embedding": torch.zeros(1, 128),
+        "hidden_hist_mem": mem,
+        "hist_mem": mem,
+        "memory": (mem, mem),
+    }
+    params = inspect.signature(getattr(model, name)).parameters
+    return [shapes[p] for p in params]
+
+
+def export(module, args, path):
+    input_names = [f"arg{i}" for i in range(len(args))]
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # The TorchScript exporter, newer torch defaults to torch.export
+        kwargs["dynamo"] = False
+    # In the module's own mode, batch norm in a training model normalises with the batch's statistics as torch does
+    torch.onnx.export(module, tuple(args), path, input_names=input_names,
+                      dynamic_axes={n: {0: "batch"} for n in input_names},
+                      training=torch.onnx.TrainingMode.PRESERVE, do_constant_folding=not module.training, **kwargs)
+
+
+def export_onnx(model, out_dir):
+    """
+    export the per-step actor computation of an agent model to out_dir/<method>.onnx
+    in the model's current train or eval mode, so batch norm layers behave as in the torch model
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    for name in EXPORTED_METHODS:
+        if hasattr(model, name):
+            args = example_inputs(model, name)
+            memory = isinstance(args[-1], tuple)
+            if memory:
+                args = [*args[:-1], *args[-1]]
+            export(MethodModule(model, name, memory), args, os.path.join(out_dir, f"{name}.onnx"))
+
+    if hasattr(model, "question_rnn"):
+        hx = torch.zeros(1, model.question_rnn.lstm_size)
+        word = torch.zeros(1, dtype=torch.long)
+        export(MethodModule(model.question_rnn, "process_single_input", memory=True),
+               [word, hx, hx], os.path.join(out_dir, "question_step.onnx"))
+
+
+class OnnxSession:
+    """
+    onnxruntime session called like the torch method it was exported from
+    """
+    def __init__(self, path, memory=False, obs=False):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        # Inputs the graph does not use are pruned at export
+        self.inputs = {i.name for i in self.session.get_inputs()}
+        self.memory = memory
+        self.obs = obs
+
+    def __call__(self, *args):
+        if self.memory:
+            *args, (h, c) = args
+            args = (*args, h, c)
+        if self.obs:
+            args = (args[0].reshape(-1, 7 * 7 * 3), *args[1:])
+        feed = {f"arg{i}": torch.as_tensor(a).numpy() for i, a in enumerate(args) if f"arg{i}" in self.inputs}
+        outputs = [torch.from_numpy(o) for o in self.session.run(None, feed)]
+        if self.memory:
+            *outputs, h, c = outputs
+            outputs = (*outputs, (h, c))
+        return outputs[0] if len(outputs) == 1 else tuple(outputs)
+
+
+class OnnxQuestionRNN:
+    def __init__(self, question_rnn, out_dir):
+        self.dataset = question_rnn.dataset
+        self.embedding = question_rnn.embedding
+        self.process_single_input = OnnxSession(os.path.join(out_dir, "question_step.onnx"), memory=True)
+
+
+class OnnxActor:
+    """
+    onnxruntime stand-in for an agent model on the acting path
+    the question sampling loop is the model class's own gen_question, run over the exported step
+    the model is exported the first time the actor runs, so weights that are never acted with are never exported
+    """
+    def __init__(self, model, out_dir):
+        self.model = model
+        self.out_dir = out_dir
+        self.model_cls = type(model)
+        self.mem_hidden_dim = model.mem_hidden_dim
+        self.image_conv_dim = getattr(model, "image_conv_dim", None)
+        self.softmax = nn.Softmax(dim=-1)
+
+    def __getattr__(self, name):
+        # Only called for attributes not set yet, the exported sessions before the first export
+        if name == "model" or self.__dict__.get("model") is None:
+            raise AttributeError(name)
+        self.load()
+        return getattr(self, name)
+
+    def load(self):
+        model, out_dir = self.model, self.out_dir
+        self.model = None
+        export_onnx(model, out_dir)
+
+        for name in EXPORTED_METHODS:
+            if hasattr(model, name):
+                path = os.path.join(out_dir, f"{name}.onnx")
+                setattr(self, name, OnnxSession(path, memory=name == "remember", obs=True))
+
+        if hasattr(model, "question_rnn"):
+            self.question_rnn = OnnxQuestionRNN(model.question_rnn, out_dir)
+
+    def gen_question(self, obs, encoded_memory):
+        return self.model_cls.gen_question(self, obs, encoded_memory)
+
+    def question_memory(self, obs, encoded_memory):
+        return self.model_cls.question_memory(self, obs, encoded_memory)
+
+    def emebed_question(self, question):
+        return self.model_cls.emebed_question(self, question)
+
+
+class OnnxExporter:
+    """
+    actor_transform running the acting path on onnxruntime
+    every sync exports the learner weights again when they are first acted with, so it is meant for train=False runs
+    the exports share one directory, a temporary one unless out_dir is given, removed on close
+    """
+    def __init__(self, out_dir=None):
+        if out_dir is None:
+            out_dir = tempfile.mkdtemp(prefix="onnx_actor_")
+            self.cleanup = weakref.finalize(self, shutil.rmtree, out_dir, ignore_errors=True)
+        else:
+            self.cleanup = None
+        self.out_dir = out_dir
+
+    def __call__(self, model):
+        return OnnxActor(model, self.out_dir)
+
+    def close(self):
+        if self.cleanup is not None:
+            self.cleanup()
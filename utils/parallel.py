@@ -0,0 +1,49 @@
+import multiprocessing as mp
+import os
+import torch
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def core_groups(n_workers):
+    """
+    split the cores this process may run on into one disjoint group per worker
+    with more workers than cores, workers share single cores round robin
+    """
+    cores = available_cores()
+    if n_workers >= len(cores):
+        return [[cores[i % len(cores)]] for i in range(n_workers)]
+    size = len(cores) // n_workers
+    return [cores[i * size:(i + 1) * size] for i in range(n_workers)]
+
+
+def pin_cores(cores):
+    # Torch threads match the pinned cores to avoid oversubscription
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+
+
+def pin_worker(groups, started):
+    # Runs once in each pool process,
+    # workers take the groups in start order, a replacement for a worker that exited wraps around to a used one
+    with started.get_lock():
+        index = started.value
+        started.value += 1
+    pin_cores(groups[index % len(groups)])
+
+
+def run_parallel(fn, args_list, n_workers):
+    """
+    call fn(*args) for every args in args_list on a pool of pinned worker processes
+    returns the results in the order of args_list
+    """
+    ctx = mp.get_context("spawn")
+    started = ctx.Value("i", 0)
+
+    with ctx.Pool(n_workers, initializer=pin_worker, initargs=(core_groups(n_workers), started)) as pool:
+        return pool.starmap(fn, args_list)
@@ -0,0 +1,269 @@
+import copy
+import inspect
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.distributions as distributions
+
+from language_model.model import sample_questions, decode_questions
+from utils.Trainer import Transition, inference_mode
+from utils.agent import set_up_agent
+from utils.batched_env import BatchedGridEnv
+from utils.env import make_batched_oracle_envs, make_oracle_envs, seed_everything
+
+
+class UnfusedLSTMCell(nn.LSTMCell):
+    """
+    LSTMCell written out in plain ops, vmap has no batching rule for the fused kernel
+    """
+    def forward(self, input, hx):
+        h, c = hx
+        gates = F.linear(input, self.weight_ih, self.bias_ih) + F.linear(h, self.weight_hh, self.bias_hh)
+        i, f, g, o = gates.chunk(4, 1)
+        c = torch.sigmoid(f) * c + torch.sigmoid(i) * torch.tanh(g)
+        h = torch.sigmoid(o) * torch.tanh(c)
+        return h, c
+
+
+class BoundMethod(nn.Module):
+    # functional_call only calls forward, this forwards to a (dotted) method of the model
+    def __init__(self, module, name):
+        super().__init__()
+        self.module = module
+        self.name = name
+
+    def forward(self, *args):
+        method = self.module
+        for attr in self.name.split("."):
+            method = getattr(method, attr)
+        return method(*args)
+
+
+def method_args(method, inputs):
+    # Pick a model method's arguments by name, the model classes differ in what they take
+    return [inputs[param] for param in inspect.signature(method).parameters]
+
+
+class Population:
+    """
+    K independently seeded agents acting as one batched computation
+    their weights are stacked along a leading agent dim and the model methods vmapped over it,
+    every agent keeps its own model, optimizers and update
+    """
+    def __init__(self, agents):
+        if not hasattr(torch, "func"):
+            raise RuntimeError(f"population training needs torch.func, torch {torch.__version__} has none")
+        self.agents = agents
+
+        # Skeleton the stacked weights are swapped into, running batch norm stats cannot be vmapped
+        self.base = copy.deepcopy(agents[0].model)
+        torch.func.replace_all_batch_norm_modules_(self.base)
+        for module in self.base.modules():
+            if type(module) is nn.LSTMCell:
+                module.__class__ = UnfusedLSTMCell
+
+        self.names = [name for name, _ in self.base.named_parameters()] + \
+                     [name for name, _ in self.base.named_buffers()]
+        states = [agent.model.state_dict() for agent in agents]
+        self.weights = {name: torch.stack([state[name].detach() for state in states]) for name in self.names}
+        self.methods = {}
+
+    def __len__(self):
+        return len(self.agents)
+
+    def sync(self, k):
+        # After agent k updated, refresh its slice of the stacked weights
+        state = self.agents[k].model.state_dict()
+        with torch.no_grad():
+            for name in self.names:
+                self.weights[name][k].copy_(state[name])
+
+    def call(self, name, *args):
+        """
+        run a model method for all agents at once, every arg has a leading agent dim
+        """
+        if name not in self.methods:
+            module = BoundMethod(self.base, name)
+
+            def method(weights, *args):
+                weights = {"module." + name: weight for name, weight in weights.items()}
+                return torch.func.functional_call(module, weights, args)
+
+            self.methods[name] = torch.func.vmap(method)
+        return self.methods[name](self.weights, *args)
+
+    def call_with(self, name, inputs):
+        return self.call(name, *method_args(getattr(self.base, name), inputs))
+
+    def ask(self, obs, hidden_hist_mem):
+        """
+        batched gen_question, one question per agent, sampled token by token in lockstep
+        returns per agent the question, last hidden state, mean log prob, entropy, tokens and cell state
+        """
+        dataset = self.base.question_rnn.dataset
+
+        hx = self.call("question_memory", obs, hidden_hist_mem)
+        cx = torch.randn(hx.shape)
+
+        def step(x, memory):
+            logits, memory = self.call("question_rnn.process_single_input", x.view(-1, 1), memory)
+            return logits.squeeze(1), memory
+
+        tokens, lengths, log_probs, entropies, hidden_q = sample_questions(
+            step, (hx, cx), dataset.word_to_index['<sos>'], dataset.word_to_index['<eos>'])
+        questions, log_prob_qa, entropy_qa, question_tokens = decode_questions(
+            dataset, tokens, lengths, log_probs, entropies)
+
+        return questions, hidden_q, log_prob_qa, entropy_qa, question_tokens, cx
+
+    def embed(self, question_tokens):
+        # Batched emebed_question over the sampled ids
+        lengths = torch.tensor([len(tokens) for tokens in question_tokens])
+        tokens = nn.utils.rnn.pad_sequence(question_tokens, batch_first=True)
+        return self.call("embed_questions", tokens.unsqueeze(1), lengths.unsqueeze(1)).squeeze(1)
+
+    def act(self, inputs):
+        """
+        batched agent.act, inputs maps the policy's argument names to stacked tensors
+        """
+        logits = self.call_with("policy", inputs).squeeze(1)
+        temperature = torch.tensor([agent.T for agent in self.agents], dtype=torch.float).unsqueeze(1)
+        action_prob = F.softmax(logits / temperature, dim=-1)
+        dist = distributions.Categorical(action_prob)
+        action = dist.sample()
+        probs = action_prob.gather(1, action.unsqueeze(1)).squeeze(1)
+        return action, probs, dist.entropy()
+
+    def remember(self, inputs, action):
+        inputs = dict(inputs, action=F.one_hot(action, 7).float().unsqueeze(1))
+        return self.call_with("remember", inputs)
+
+
+def make_population(cfg, n_agents):
+    """
+    one agent and one pair of oracle envs per seed, seeds cfg.seed ... cfg.seed + n_agents - 1
+    with cfg.batched_env the envs of each pair are BatchedGridEnvs, stepped as one
+    """
+    agents, train_envs, test_envs = [], [], []
+    for k in range(n_agents):
+        seed_cfg = copy.copy(cfg)
+        seed_cfg.seed = cfg.seed + k
+        seed_cfg.use_seed = True
+        # Acting goes through the stacked weights, the agents only learn
+        seed_cfg.compile_mode, seed_cfg.actor_backend = "eager", "torch"
+
+        if cfg.batched_env:
+            seed_everything(seed_cfg.seed)
+        else:
+            env_train, env_test = make_oracle_envs(seed_cfg)
+            train_envs.append(env_train)
+            test_envs.append(env_test)
+        agents.append(set_up_agent(seed_cfg))
+
+    if cfg.batched_env:
+        train_envs, test_envs = make_batched_oracle_envs(cfg, [cfg.seed + k for k in range(n_agents)])
+
+    return Population(agents), train_envs, test_envs
+
+
+def train_test_population(envs, population, cfg, n_episodes=1000, log_interval=50, train=True, verbose=True):
+    """
+    train_test for a population, envs[k] steps in lockstep with agent k
+    every agent runs n_episodes, returns one reward history per agent
+    """
+    agents = population.agents
+    n_agents = len(population)
+
+    episodes = [0] * n_agents
+    episode_reward = [[] for _ in range(n_agents)]
+    reward_history = [[] for _ in range(n_agents)]
+
+    states = [env.reset()['image'] for env in envs]  # Discard other info
+    hist_mem = [agent.init_memory() for agent in agents]
+
+    avg_syntax_r = 0
+    last_time = time.time()
+    logged = 0
+
+    while min(episodes) < n_episodes:
+        with inference_mode():
+            obs = torch.FloatTensor(np.stack(states))
+            hidden_hist_mem = torch.stack([mem[0] for mem in hist_mem])
+            cell_hist_mem = torch.stack([mem[1] for mem in hist_mem])
+            inputs = {"obs": obs, "hist_mem": hidden_hist_mem, "hidden_hist_mem": hidden_hist_mem,
+                      "memory": (hidden_hist_mem, cell_hist_mem)}
+
+            if cfg.baseline:
+                answers, reward_qa, entropy_qa = [1] * n_agents, [0] * n_agents, [1] * n_agents
+                log_prob_qa = [1.0] * n_agents
+
+                #dummy not to break transtition
+                hidden_q = torch.ones(n_agents, 128)
+                q_embedding = torch.ones(n_agents, 128)
+                question_tokens = [torch.zeros(1, dtype=torch.long)] * n_agents
+                cell_q = torch.ones(n_agents, 1, 128)
+            else:
+                questions, hidden_q, log_prob_qa, entropy_qa, question_tokens, cell_q = \
+                    population.ask(obs, hidden_hist_mem)
+
+                answers, reward_qa = zip(*[env.answer(question) for env, question in zip(envs, questions)])
+                answers = [answer.encode() for answer in answers]
+                avg_syntax_r += 1 / log_interval * (np.mean(reward_qa) - avg_syntax_r)
+
+                if cfg.q_embed:
+                    q_embedding = population.embed(question_tokens)
+                else:
+                    q_embedding = torch.ones(n_agents, 128)
+
+                inputs.update(answer=torch.FloatTensor(np.stack(answers)).view(n_agents, 1, 2),
+                              hidden_q=hidden_q, q_embedding=q_embedding.unsqueeze(1))
+
+            action, log_prob_act, entropy_act = population.act(inputs)
+
+            if cfg.use_mem:
+                next_h, next_c = population.remember(inputs, action)
+
+        if isinstance(envs, BatchedGridEnv):
+            images, rewards, dones = envs.step(action.numpy())
+            steps = zip(images, rewards.tolist(), dones.tolist())
+        else:
+            steps = [(obs['image'], reward, done) for obs, reward, done, _ in
+                     (env.step(a) for env, a in zip(envs, action.tolist()))]
+
+        for k, (env, agent, (next_state, reward, done)) in enumerate(zip(envs, agents, steps)):
+            if episodes[k] < n_episodes:
+                agent.store(Transition(states[k], answers[k], hidden_q[k], action[k].item(), reward, reward_qa[k],
+                                       log_prob_act[k].item(), log_prob_qa[k], entropy_act[k].item(),
+                                       entropy_qa[k], done, q_embedding[k], hist_mem[k][0], hist_mem[k][1],
+                                       question_tokens[k], cell_q[k]))
+                episode_reward[k].append(reward)
+
+            states[k] = next_state
+            hist_mem[k] = (next_h[k], next_c[k]) if cfg.use_mem else agent.init_memory()
+
+            if done:
+                if episodes[k] < n_episodes:
+                    if train and len(agent.data) >= 2:
+                        agent.update()
+                        agent.replay()
+                        population.sync(k)
+                    reward_history[k].append(sum(episode_reward[k]))
+                    episodes[k] += 1
+                episode_reward[k] = []
+
+                states[k] = env.reset()['image']
+                hist_mem[k] = agent.init_memory()
+
+        if verbose and min(episodes) >= logged + log_interval:
+            logged += log_interval
+            current_time = time.time()
+            avg_R = np.mean([np.mean(history[logged - log_interval:logged]) for history in reward_history])
+            print(f"Episode: {logged}, Reward: {avg_R:.2f} (mean of {n_agents} seeds), "
+                  f"Avg. Reward Question {avg_syntax_r:.3f}, "
+                  f"Episodes/sec: {n_agents * log_interval / (current_time - last_time):.1f} ")
+            avg_syntax_r = 0
+            last_time = current_time
+
+    return reward_history
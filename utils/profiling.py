@@ -0,0 +1,114 @@
+import functools
+import os
+from torch.profiler import ProfilerActivity, profile, record_function, schedule
+
+from utils.storage import create_folders_if_necessary
+
+# Methods labelled in the trace, the ones a class does not have are skipped
+AGENT_METHODS = ["ask", "act", "remember", "update", "replay", "transition_to_tensors", "optimize"]
+MODEL_METHODS = ["gen_question", "replay_question", "question_memory", "encode_obs", "embed_questions",
+                 "policy", "value", "remember", "replay_memory"]
+
+
+def _labelled(name, method):
+    @functools.wraps(method)
+    def call(*args, **kwargs):
+        with record_function(name):
+            return method(*args, **kwargs)
+    return call
+
+
+class _LabelledPhase:
+    __slots__ = ("name", "inner", "record")
+
+    def __init__(self, name, inner):
+        self.name = name
+        self.inner = inner
+        self.record = None
+
+    def __enter__(self):
+        self.record = record_function(self.name)
+        self.record.__enter__()
+        self.inner.__enter__()
+
+    def __exit__(self, *exc):
+        self.inner.__exit__(*exc)
+        self.record.__exit__(*exc)
+
+
+class _LabelledTimer:
+    """
+    a PhaseTimer or NullTimer whose phases also show up as ranges in the trace while the profiler runs
+    """
+    def __init__(self, timer, profiler):
+        self.timer = timer
+        self.profiler = profiler
+
+    def phase(self, name):
+        if not self.profiler.running:
+            return self.timer.phase(name)
+        return _LabelledPhase(name, self.timer.phase(name))
+
+    def report(self, step, logger=None):
+        return self.timer.report(step, logger)
+
+
+class EpisodeProfiler:
+    """
+    torch.profiler over cfg.profile_episodes episodes of train_test, after cfg.profile_skip episodes and one of warmup
+    the agent and model methods are labelled with record_function while it runs and restored afterwards,
+    writes trace.json for chrome://tracing or Perfetto and profile_ops.txt, the top ops by self CPU time, to out_dir
+    """
+    def __init__(self, cfg, agent, out_dir, row_limit=40):
+        self.out_dir = out_dir
+        self.row_limit = row_limit
+        self.labelled = []
+        self.label(agent, AGENT_METHODS, type(agent).__name__)
+        self.label(agent.model, MODEL_METHODS, type(agent.model).__name__)
+
+        self.profiler = profile(activities=[ProfilerActivity.CPU],
+                                schedule=schedule(wait=cfg.profile_skip, warmup=1, active=cfg.profile_episodes,
+                                                  repeat=1),
+                                on_trace_ready=self.save, record_shapes=True)
+        self.window = cfg.profile_skip + 1 + cfg.profile_episodes
+        self.steps = 0
+        self.profiler.start()
+        self.running = True
+
+    def label(self, obj, names, prefix):
+        for name in names:
+            if hasattr(obj, name) and name not in vars(obj):
+                setattr(obj, name, _labelled(f"{prefix}.{name}", getattr(obj, name)))
+                self.labelled.append((obj, name))
+
+    def timer(self, timer):
+        return _LabelledTimer(timer, self)
+
+    def save(self, profiler):
+        trace_path = os.path.join(self.out_dir, "trace.json")
+        create_folders_if_necessary(trace_path)
+        profiler.export_chrome_trace(trace_path)
+        table = profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=self.row_limit)
+        with open(os.path.join(self.out_dir, "profile_ops.txt"), "w") as file:
+            file.write(table + "\n")
+        # Small ops at many input shapes, the same table grouped by shape
+        table = profiler.key_averages(group_by_input_shape=True).table(sort_by="self_cpu_time_total",
+                                                                       row_limit=self.row_limit)
+        with open(os.path.join(self.out_dir, "profile_ops_by_shape.txt"), "w") as file:
+            file.write(table + "\n")
+
+    def step(self):
+        # Called at the end of every episode, profiler and labels go once the window was written
+        if self.running:
+            self.profiler.step()
+            self.steps += 1
+            if self.steps >= self.window:
+                self.close()
+
+    def close(self):
+        if self.running:
+            self.profiler.stop()
+            self.running = False
+        for obj, name in self.labelled:
+            delattr(obj, name)
+        self.labelled = []
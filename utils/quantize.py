@@ -0,0 +1,20 @@
+import copy
+import torch
+import torch.nn as nn
+
+# Layers with a dynamic int8 kernel, convolutions and embeddings stay float
+QUANTIZED_LAYERS = {nn.Linear, nn.LSTMCell}
+
+
+class DynamicQuantizer:
+    """
+    actor_transform giving an int8 dynamically quantized copy of an agent model
+    the learner keeps the float32 model, the copy is rebuilt from its weights on every sync
+    """
+    def __init__(self, model):
+        # Float shadow to load the learner weights into, taken before any compile_model
+        self.shadow = copy.deepcopy(model)
+
+    def __call__(self, model):
+        self.shadow.load_state_dict(model.state_dict())
+        return torch.quantization.quantize_dynamic(self.shadow, QUANTIZED_LAYERS, dtype=torch.qint8)
@@ -0,0 +1,44 @@
+import random
+from collections import deque
+import torch
+
+
+class ReplayBuffer:
+    """
+    the most recent episodes an agent learned from, each a list of transitions as collected,
+    so their stored behaviour probs stay with them for the off-policy correction
+    """
+    def __init__(self, size, seed=None):
+        self.episodes = deque(maxlen=size)
+        self.random = random.Random(seed)
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def add(self, transitions):
+        self.episodes.append(list(transitions))
+
+    def sample(self, n):
+        return [self.random.choice(self.episodes) for _ in range(n)]
+
+
+def vtrace(reward, not_done, V_pred, next_V_pred, rho, gamma, lmbda, rho_bar=1.0, c_bar=1.0):
+    """
+    the agent's TD targets and GAE advantages for an episode collected by an older policy,
+    corrected with V-trace's truncated importance weights (Espeholt et al. 2018),
+    rho holds pi / mu of every taken action, truncated at rho_bar for the TD errors and at c_bar for the traces
+    a step's target is V + rho * delta, and its advantage sums the later TD errors with traces cut by the
+    ratios of the later actions, its own ratio is left to the PPO surrogate, with rho = 1 both are the on-policy ones
+    """
+    V, next_V = V_pred.detach(), next_V_pred.detach()
+    delta = reward + gamma * next_V * not_done - V
+    target = V + rho.clamp(max=rho_bar) * delta
+
+    # c of the next step, past the last step there is nothing left to trace
+    c = lmbda * torch.cat((rho[1:].clamp(max=c_bar), rho.new_zeros(1)))
+    advantage = torch.zeros_like(V)
+    acc = 0.0
+    for t in reversed(range(len(delta))):
+        acc = delta[t] + gamma * c[t] * not_done[t] * acc
+        advantage[t] = acc
+    return target, advantage.unsqueeze(1)
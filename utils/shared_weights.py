@@ -0,0 +1,57 @@
+import torch
+
+
+class SharedWeights:
+    """
+    a model's state dict published through shared memory, double buffered
+    the writer fills the slot readers are not on and then bumps the publication counter,
+    every slot has a seqlock counter that is odd while the slot is written,
+    a reader retries unless it saw the same even count before and after its copy, so it never keeps a torn copy
+    pickles to child processes as a handle on the same memory
+    """
+    def __init__(self, model):
+        self.layout = []
+        offset = 0
+        for name, tensor in model.state_dict().items():
+            self.layout.append((name, offset, tensor.numel(), tensor.shape))
+            offset += tensor.numel()
+
+        # Integer buffers (batch norm counters) are small enough to round trip through float32
+        self.arena = torch.zeros(2, offset).share_memory_()
+        # Publication counter, then each slot's seqlock counter, then the policy version held in each slot
+        self.meta = torch.zeros(5, dtype=torch.long).share_memory_()
+        self.seen = 0
+
+    def publish(self, model, version):
+        seq = int(self.meta[0]) + 1
+        slot = seq % 2
+        state = model.state_dict()
+        self.meta[1 + slot] += 1
+        with torch.no_grad():
+            for name, offset, numel, _ in self.layout:
+                self.arena[slot, offset:offset + numel].copy_(state[name].reshape(-1))
+        self.meta[3 + slot] = version
+        self.meta[1 + slot] += 1
+        self.meta[0] = seq
+
+    def load(self, model):
+        """
+        copy the newest published weights into model
+        returns their version, or None if there is nothing newer than the last load
+        """
+        state = model.state_dict()
+        while True:
+            seq = int(self.meta[0])
+            if seq == self.seen:
+                return None
+            slot = seq % 2
+            slot_seq = int(self.meta[1 + slot])
+            if slot_seq % 2:
+                continue
+            version = int(self.meta[3 + slot])
+            with torch.no_grad():
+                for name, offset, numel, shape in self.layout:
+                    state[name].copy_(self.arena[slot, offset:offset + numel].view(shape))
+            if int(self.meta[1 + slot]) == slot_seq:
+                self.seen = seq
+                return version
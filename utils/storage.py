@@ -1,3 +1,6 @@
+import copy
+import functools
+import inspect
 import os
 import torch
 
@@ -17,9 +20,36 @@ def get_model_dir(model_name):
 def get_status_path(model_dir):
     return os.path.join(model_dir, "status.pt")
 
+def torch_load(path, mmap=True):
+    """
+    torch.load of a full checkpoint (not only weights), memory-mapped when this torch supports it
+    """
+    params = inspect.signature(torch.load).parameters
+    kwargs = {}
+    if "weights_only" in params:
+        kwargs["weights_only"] = False  # status.pt holds the Config dataclass
+    if mmap and "mmap" in params:
+        try:
+            return torch.load(path, mmap=True, **kwargs)
+        except RuntimeError:
+            pass  # legacy non-zip checkpoints cannot be mapped
+    return torch.load(path, **kwargs)
+
+@functools.lru_cache(maxsize=64)
+def _load_cached(path, mtime_ns, size):
+    return torch_load(path)
+
+def load_checkpoint(path):
+    """
+    read a checkpoint once per process, later calls reuse it until the file changes
+    the result is shared, copy anything you mutate
+    """
+    stat = os.stat(path)
+    return _load_cached(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
 def get_status(model_dir):
     path = get_status_path(model_dir)
-    return torch.load(path)
+    return load_checkpoint(path)
 
 def save_status(status, model_dir):
     path = get_status_path(model_dir)
@@ -27,7 +57,7 @@ def save_status(status, model_dir):
     torch.save(status, path)
 
 def get_config(model_dir):
-    return get_status(model_dir)["config"]
+    return copy.copy(get_status(model_dir)["config"])
 
 def get_model_state(model_dir):
-    return get_status(model_dir)["model_state"]
\ No newline at end of file
+    return get_status(model_dir)["model_state"]
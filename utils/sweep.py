@@ -0,0 +1,121 @@
+import copy
+import json
+import math
+import os
+from dataclasses import fields
+import numpy as np
+
+from utils.default_config import Config
+from utils.storage import get_model_dir, get_storage_dir
+from utils.parallel import run_parallel
+
+
+def sample_value(spec, rng):
+    """
+    one draw from a wandb style parameter spec:
+    {values: [...]}, {min, max} uniform or {min, max, distribution: log_uniform}
+    """
+    if "values" in spec:
+        return spec["values"][rng.integers(len(spec["values"]))]
+    if "value" in spec:
+        return spec["value"]
+
+    low, high = spec["min"], spec["max"]
+    distribution = spec.get("distribution", "int_uniform" if isinstance(low, int) and isinstance(high, int)
+                            else "uniform")
+    if distribution == "uniform":
+        return float(rng.uniform(low, high))
+    if distribution == "log_uniform":
+        return float(np.exp(rng.uniform(np.log(low), np.log(high))))
+    if distribution == "int_uniform":
+        return int(rng.integers(low, high + 1))
+    raise ValueError(f"Unknown distribution {distribution}")
+
+
+def sample_configs(base_cfg, parameters, n_trials, seed=0):
+    # One Config per trial, named like the wandb sweep runs in storage
+    known = {field.name for field in fields(Config)}
+    unknown = set(parameters) - known
+    if unknown:
+        raise ValueError(f"Sweep parameters {sorted(unknown)} are not Config fields")
+
+    rng = np.random.default_rng(seed)
+    configs = []
+    for i in range(n_trials):
+        cfg = copy.copy(base_cfg)
+        for name, spec in parameters.items():
+            setattr(cfg, name, sample_value(spec, rng))
+        cfg.name = f"{base_cfg.name}-sweep-{i}"
+        cfg.wandb = False
+        cfg.load = False
+        configs.append(cfg)
+    return configs
+
+
+def rung_budgets(min_episodes, max_episodes, eta):
+    budgets = [min_episodes]
+    while budgets[-1] * eta < max_episodes:
+        budgets.append(budgets[-1] * eta)
+    if budgets[-1] < max_episodes:
+        budgets.append(max_episodes)
+    return budgets
+
+
+def run_trial(cfg, n_episodes, window, resume=False):
+    """
+    train a trial up to n_episodes in total, with resume continuing from its last rung's checkpoint
+    returns the mean reward over the last window episodes
+    """
+    # Imported here, worker processes only pay for torch and gym when they run a trial
+    from utils.Trainer import train_test
+    from utils.agent import set_up_agent
+    from utils.env import make_oracle_envs
+
+    env_train, _ = make_oracle_envs(cfg)
+    agent = set_up_agent(cfg)
+    reward_history = train_test(env_train, agent, cfg, n_episodes=n_episodes,
+                                log_interval=cfg.train_log_interval, train=True, verbose=False,
+                                checkpoint_dir=get_model_dir(cfg.name), resume=resume)
+    return float(np.mean(reward_history[-window:]))
+
+
+def successive_halving(configs, budgets, eta=2, window=100, workers=1, verbose=True):
+    """
+    run every config to the first budget, keep the best 1/eta, run those to the next budget, ...
+    returns one record per trial with its overrides and score at each rung it reached
+    """
+    for cfg in configs:
+        # Every rung ends with a checkpoint the next rung resumes from
+        if not cfg.checkpoint_interval:
+            cfg.checkpoint_interval = budgets[0]
+
+    records = [{"name": cfg.name, "config": cfg.__dict__, "scores": {}} for cfg in configs]
+    alive = list(range(len(configs)))
+
+    for rung, budget in enumerate(budgets):
+        # Rung 0 starts fresh, a checkpoint left by an earlier sweep under the same trial name is overwritten
+        args = [(configs[i], budget, window, rung > 0) for i in alive]
+        if workers > 1:
+            scores = run_parallel(run_trial, args, workers)
+        else:
+            scores = [run_trial(*a) for a in args]
+
+        for i, score in zip(alive, scores):
+            records[i]["scores"][budget] = score
+
+        ranked = sorted(zip(alive, scores), key=lambda pair: pair[1], reverse=True)
+        if verbose:
+            print(f"Rung {rung}, {budget} episodes: " +
+                  ", ".join(f"{configs[i].name} {score:.3f}" for i, score in ranked))
+
+        alive = [i for i, _ in ranked[:max(1, math.ceil(len(ranked) / eta))]]
+
+    return records
+
+
+def save_sweep(records, name):
+    path = os.path.join(get_storage_dir(), f"{name}-sweep.json")
+    os.makedirs(get_storage_dir(), exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump(records, file, default=str)
+    return path
@@ -0,0 +1,119 @@
+import gym
+import numpy as np
+from gym import spaces
+from gym.utils import seeding
+from gym_minigrid.minigrid import COLOR_TO_IDX, OBJECT_TO_IDX, STATE_TO_IDX
+
+VIEW_SIZE = 7
+WALL = (OBJECT_TO_IDX['wall'], COLOR_TO_IDX['grey'], 0)
+EMPTY = (OBJECT_TO_IDX['empty'], 0, 0)
+OBJECTS = ['key', 'ball', 'box', 'door']
+# Cells the agent can move onto
+WALKABLE = [OBJECT_TO_IDX['empty'], OBJECT_TO_IDX['goal']]
+
+
+class SyntheticGrid:
+    """
+    the part of gym_minigrid's Grid OracleWrapper reads, a fixed (width, height, 3) encoding
+    """
+    def __init__(self, encoded):
+        self.encoded = encoded
+        self.width, self.height = encoded.shape[:2]
+
+    def encode(self):
+        return self.encoded
+
+
+class SyntheticEnv(gym.Env):
+    """
+    MiniGrid stand-in at almost no simulation cost, for timing and testing the agent and learner on their own
+    n_levels random levels, walls around size x size cells with a goal and n_objects keys, balls, boxes and doors,
+    are generated when seeded and replayed in turn on reset
+    the agent turns and moves forward as in MiniGrid and sees the 7x7 encoded cells ahead of it, without occlusion,
+    reaching the goal pays 1 - 0.9 * steps / max_steps, an episode ends there or after max_steps
+    """
+    metadata = {'render.modes': []}
+
+    def __init__(self, size=8, max_steps=40, n_objects=4, n_levels=64):
+        self.size = size
+        self.max_steps = max_steps
+        self.n_objects = n_objects
+        self.n_levels = n_levels
+
+        self.observation_space = spaces.Dict({
+            'image': spaces.Box(low=0, high=255, shape=(VIEW_SIZE, VIEW_SIZE, 3), dtype='uint8')
+        })
+        self.action_space = spaces.Discrete(7)
+        self.mission = "get to the green goal square"
+
+        self.seed()
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        self.levels = [self.gen_level() for _ in range(self.n_levels)]
+        self.level = 0
+        return [seed]
+
+    def gen_level(self):
+        encoded = np.empty((self.size, self.size, 3), dtype='uint8')
+        encoded[...] = EMPTY
+        encoded[[0, -1], :] = WALL
+        encoded[:, [0, -1]] = WALL
+
+        # Distinct interior cells for the goal, the objects and the agent
+        interior = [(x, y) for x in range(1, self.size - 1) for y in range(1, self.size - 1)]
+        cells = self.np_random.choice(len(interior), self.n_objects + 2, replace=False)
+        cells = [interior[i] for i in cells]
+
+        encoded[cells[0]] = (OBJECT_TO_IDX['goal'], COLOR_TO_IDX['green'], 0)
+        for cell in cells[1:-1]:
+            name = OBJECTS[self.np_random.integers(len(OBJECTS))]
+            state = STATE_TO_IDX['closed'] if name == 'door' else 0
+            encoded[cell] = (OBJECT_TO_IDX[name], self.np_random.integers(len(COLOR_TO_IDX)), state)
+
+        # Walls around the grid, so every view is a plain slice
+        pad = VIEW_SIZE - 1
+        padded = np.empty((self.size + 2 * pad, self.size + 2 * pad, 3), dtype='uint8')
+        padded[...] = WALL
+        padded[pad:-pad, pad:-pad] = encoded
+
+        return SyntheticGrid(encoded), padded, cells[-1], int(self.np_random.integers(4))
+
+    def reset(self):
+        self.grid, self.padded, self.agent_pos, self.agent_dir = self.levels[self.level]
+        self.level = (self.level + 1) % self.n_levels
+        self.step_count = 0
+        return self.gen_obs()
+
+    def gen_obs(self):
+        # MiniGrid's get_view_exts, then rotate_left agent_dir + 1 times, which is a clockwise rot90 on (x, y) arrays
+        x, y = self.agent_pos
+        half = VIEW_SIZE // 2
+        top_x, top_y = [(x, y - half), (x - half, y), (x - VIEW_SIZE + 1, y - half),
+                        (x - half, y - VIEW_SIZE + 1)][self.agent_dir]
+        pad = VIEW_SIZE - 1
+        view = self.padded[top_x + pad:top_x + pad + VIEW_SIZE, top_y + pad:top_y + pad + VIEW_SIZE]
+        image = np.rot90(view, -(self.agent_dir + 1)).copy()
+        image[half, VIEW_SIZE - 1] = EMPTY  # The agent carries nothing
+        return {'image': image, 'direction': self.agent_dir, 'mission': self.mission}
+
+    def step(self, action):
+        self.step_count += 1
+        reward, done = 0, False
+
+        if action == 0:
+            self.agent_dir = (self.agent_dir - 1) % 4
+        elif action == 1:
+            self.agent_dir = (self.agent_dir + 1) % 4
+        elif action == 2:
+            dx, dy = [(1, 0), (0, 1), (-1, 0), (0, -1)][self.agent_dir]
+            front = (self.agent_pos[0] + dx, self.agent_pos[1] + dy)
+            cell = self.grid.encode()[front][0]
+            if cell in WALKABLE:
+                self.agent_pos = front
+            if cell == OBJECT_TO_IDX['goal']:
+                reward, done = 1 - 0.9 * (self.step_count / self.max_steps), True
+
+        if self.step_count >= self.max_steps:
+            done = True
+        return self.gen_obs(), reward, done, {}
@@ -0,0 +1,99 @@
+import json
+import time
+from collections import defaultdict
+import numpy as np
+
+from utils.storage import create_folders_if_necessary
+
+
+class _Phase:
+    __slots__ = ("samples", "start")
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.samples.append(time.perf_counter() - self.start)
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+class NullTimer:
+    """
+    PhaseTimer stand-in when timing is off, every phase is the same shared no-op context
+    """
+    _phase = _NoPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def report(self, step, logger=None):
+        return {}
+
+
+class PhaseTimer:
+    """
+    wall time and call count of every phase of the training loop, timed with `with timer.phase(name):`
+    report() summarises the calls since the last report as percentiles,
+    to the logger and as one line of the json lines file at path
+    """
+    def __init__(self, path=None, percentiles=(50, 90, 99)):
+        self.path = path
+        self.percentiles = percentiles
+        self.samples = defaultdict(list)
+        # One reusable context per phase, a timed call allocates nothing
+        self.phases = {}
+
+    def phase(self, name):
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = _Phase(self.samples[name])
+        return phase
+
+    def summary(self):
+        summary = {}
+        for name, samples in self.samples.items():
+            if not samples:
+                continue
+            ms = np.array(samples) * 1000
+            stats = {"count": len(ms), "total_ms": float(ms.sum()), "mean_ms": float(ms.mean())}
+            for q, value in zip(self.percentiles, np.percentile(ms, self.percentiles)):
+                stats[f"p{q}_ms"] = float(value)
+            summary[name] = stats
+        return summary
+
+    def report(self, step, logger=None):
+        summary = self.summary()
+        if not summary:
+            return summary
+        if logger is not None:
+            logger.log({f"timing/{name}/{stat}": value
+                        for name, stats in summary.items() for stat, value in stats.items()})
+        if self.path is not None:
+            create_folders_if_necessary(self.path)
+            with open(self.path, "a") as file:
+                file.write(json.dumps({"step": step, "time": time.time(), "phases": summary}) + "\n")
+
+        self.reset()
+        return summary
+
+    def reset(self):
+        # Cleared in place, the phase contexts append to these lists
+        for samples in self.samples.values():
+            samples.clear()
+
+
+def make_timer(cfg, path=None):
+    return PhaseTimer(path) if cfg.timing else NullTimer()